@@ -0,0 +1,288 @@
+"""Ball-tree spatial index for exact nearest neighbour queries in any metric."""
+
+from typing import Callable
+
+import numpy as np
+
+from kd_tree import LEAF_SIZE
+from selection import group_by_row
+
+
+class BallTree:
+    """
+    Ball-tree over a fixed set of points.
+
+    Every node owns a contiguous range `[node_start, node_end)` of `idx_array`
+    and is bounded by a ball around the centroid of its points. Pruning only
+    relies on the triangle inequality, d(x, p) >= d(x, c) - r for every point p
+    in a ball with center c and radius r, so the tree is exact for any true
+    metric (euclidean, manhattan, chebyshev, minkowski with p >= 1).
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        leaf_size: int = LEAF_SIZE,
+    ) -> None:
+        """
+        Build the tree.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            distance_function (Callable): Vectorized kernel that maps arrays of
+                shape (n1, d) and (n2, d) to an (n1, n2) distance matrix, see
+                `distance_metrics.get_distance_function`.
+            leaf_size (int): Maximum number of points in a leaf node.
+        """
+        if leaf_size < 1:
+            raise ValueError("Parameter 'leaf_size' must be at least 1.")
+
+        self.X = np.asarray(X, dtype=float)
+        self.distance_function = distance_function
+        self.leaf_size = leaf_size
+        self.idx_array = np.arange(len(self.X))
+
+        self.node_start = []
+        self.node_end = []
+        self.node_left = []
+        self.node_right = []
+        self.node_centroids = []
+        self.node_radii = []
+
+        self._build()
+
+    def _add_node(
+        self,
+        start: int,
+        end: int,
+    ) -> int:
+        """Register a node that owns idx_array[start:end] and return its id."""
+        points = self.X[self.idx_array[start:end]]
+        centroid = points.mean(axis=0)
+        radius = self.distance_function(centroid[np.newaxis, :], points).max()
+
+        self.node_start.append(start)
+        self.node_end.append(end)
+        self.node_left.append(-1)
+        self.node_right.append(-1)
+        self.node_centroids.append(centroid)
+        self.node_radii.append(radius)
+
+        return len(self.node_start) - 1
+
+    def _build(self) -> None:
+        """Recursively split nodes at the median of their widest dimension."""
+        if len(self.X) == 0:
+            raise ValueError("Cannot build a ball-tree on an empty dataset.")
+
+        stack = [self._add_node(0, len(self.X))]
+
+        while stack:
+            node = stack.pop()
+            start, end = self.node_start[node], self.node_end[node]
+
+            if end - start <= self.leaf_size or self.node_radii[node] == 0:
+                continue
+
+            node_idx = self.idx_array[start:end]
+            points = self.X[node_idx]
+            split_dimension = int(np.argmax(np.ptp(points, axis=0)))
+
+            middle = (end - start) // 2
+            order = np.argpartition(points[:, split_dimension], middle)
+            self.idx_array[start:end] = node_idx[order]
+
+            left = self._add_node(start, start + middle)
+            right = self._add_node(start + middle, end)
+            self.node_left[node] = left
+            self.node_right[node] = right
+            stack.extend((left, right))
+
+        self.node_start = np.array(self.node_start)
+        self.node_end = np.array(self.node_end)
+        self.node_left = np.array(self.node_left)
+        self.node_right = np.array(self.node_right)
+        self.node_centroids = np.array(self.node_centroids)
+        self.node_radii = np.array(self.node_radii)
+
+    def _min_distances_to_nodes(
+        self,
+        x: np.ndarray,
+        nodes: list[int],
+    ) -> np.ndarray:
+        """Lower bounds on the distance from x to any point inside each node."""
+        centroid_distances = self.distance_function(
+            x[np.newaxis, :], self.node_centroids[nodes]
+        )[0]
+        return np.maximum(centroid_distances - self.node_radii[nodes], 0)
+
+    def _query_single(
+        self,
+        x: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Depth-first search for the k nearest neighbours of one point."""
+        best_distances = np.full(k, np.inf)
+        best_idx = np.full(k, -1)
+        stack = [(0, 0.0)]
+
+        while stack:
+            node, min_distance = stack.pop()
+
+            # Balls that are further away than the current k-th neighbour
+            # cannot contain a better candidate.
+            if min_distance > best_distances[-1]:
+                continue
+
+            left, right = self.node_left[node], self.node_right[node]
+
+            if left == -1:
+                idx = self.idx_array[
+                    self.node_start[node] : self.node_end[node]
+                ]
+                distances = self.distance_function(
+                    x[np.newaxis, :], self.X[idx]
+                )[0]
+
+                # Merge with the current best, ties are broken on the index.
+                candidate_distances = np.concatenate(
+                    (best_distances, distances)
+                )
+                candidate_idx = np.concatenate((best_idx, idx))
+                order = np.lexsort((candidate_idx, candidate_distances))[:k]
+                best_distances = candidate_distances[order]
+                best_idx = candidate_idx[order]
+                continue
+
+            left_distance, right_distance = self._min_distances_to_nodes(
+                x, [left, right]
+            )
+
+            # Push the nearer child last so that it is visited first.
+            if left_distance <= right_distance:
+                stack.append((right, right_distance))
+                stack.append((left, left_distance))
+            else:
+                stack.append((left, left_distance))
+                stack.append((right, right_distance))
+
+        return best_distances, best_idx
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours. Must not exceed the number of points
+                in the tree.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+                (n_query, k), ordered from nearest to furthest. Equal distances
+                are ordered by index.
+        """
+        if not 1 <= k <= len(self.X):
+            raise ValueError(
+                f"Expected 1 <= k <= {len(self.X)}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=float)
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=int)
+
+        for i, x in enumerate(X):
+            distances[i], indices[i] = self._query_single(x, k)
+
+        return distances, indices
+
+    def query_radius(
+        self,
+        X: np.ndarray,
+        r: float,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all points within distance r of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            r (float): Radius, points at exactly distance r are included.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: CSR-style offsets of
+                shape (n_query + 1,), and the indices and distances of the
+                neighbours of all queries concatenated, see
+                `selection.group_by_row`.
+        """
+        X = np.asarray(X, dtype=float)
+        # Start with empty arrays, so that the concatenation never fails.
+        rows = [np.empty(0, dtype=int)]
+        indices = [np.empty(0, dtype=int)]
+        distances = [np.empty(0)]
+
+        for i, x in enumerate(X):
+            stack = [0]
+
+            while stack:
+                node = stack.pop()
+                left, right = self.node_left[node], self.node_right[node]
+
+                if left == -1:
+                    idx = self.idx_array[
+                        self.node_start[node] : self.node_end[node]
+                    ]
+                    node_distances = self.distance_function(
+                        x[np.newaxis, :], self.X[idx]
+                    )[0]
+                    within = node_distances <= r
+                    rows.append(np.full(np.count_nonzero(within), i))
+                    indices.append(idx[within])
+                    distances.append(node_distances[within])
+                    continue
+
+                # Only descend into balls that can contain a point within r.
+                children = np.array([left, right])
+                stack.extend(
+                    children[self._min_distances_to_nodes(x, children) <= r]
+                )
+
+        return group_by_row(
+            np.concatenate(rows),
+            np.concatenate(indices),
+            np.concatenate(distances),
+            len(X),
+        )
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Arrays and parameters from which `from_state` rebuilds the tree."""
+        arrays = {
+            "X": self.X,
+            "idx_array": self.idx_array,
+            "node_start": self.node_start,
+            "node_end": self.node_end,
+            "node_left": self.node_left,
+            "node_right": self.node_right,
+            "node_centroids": self.node_centroids,
+            "node_radii": self.node_radii,
+        }
+        return arrays, {"leaf_size": self.leaf_size}
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> "BallTree":
+        """Rebuild a tree from `state`, without copying the arrays."""
+        tree = cls.__new__(cls)
+        tree.leaf_size = parameters["leaf_size"]
+        tree.distance_function = distance_function
+        for name, array in arrays.items():
+            setattr(tree, name, array)
+        return tree
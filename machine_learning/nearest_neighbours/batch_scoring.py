@@ -0,0 +1,126 @@
+"""
+Command line entry point that predicts query points with a saved classifier.
+
+The queries are streamed from a .npy or CSV file in chunks, and the
+predictions of every chunk are appended to the output file before the next
+chunk is read, so memory use does not depend on the number of queries. Only
+NumPy and the modules of this directory are imported, numba only when the
+saved classifier uses a compiled algorithm.
+
+    python batch_scoring.py model_directory queries.npy predictions.csv
+"""
+
+import argparse
+from collections.abc import Iterator
+from itertools import islice
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from knn import KNNClassifier
+
+# Default number of query points that are read and predicted at once.
+CHUNK_SIZE = 10_000
+
+
+def read_chunks(
+    path: Union[str, Path],
+    chunk_size: int = CHUNK_SIZE,
+    delimiter: str = ",",
+    skip_rows: int = 0,
+) -> Iterator[np.ndarray]:
+    """
+    Read query points chunk by chunk.
+
+    Args:
+        path (str | Path): A .npy file of shape (n, d), which is memory-mapped,
+            or a text file with one point per line.
+        chunk_size (int): Number of points per chunk.
+        delimiter (str): Separator of the coordinates in a text file.
+        skip_rows (int): Number of header lines of a text file.
+
+    Yields:
+        np.ndarray: Chunks of shape (chunk_size, d), the last one can be
+            shorter.
+    """
+    path = Path(path)
+
+    if path.suffix == ".npy":
+        X = np.load(path, mmap_mode="r")
+        for start in range(0, len(X), chunk_size):
+            yield np.asarray(X[start : start + chunk_size], dtype=float)
+        return
+
+    with path.open() as file:
+        lines = islice(file, skip_rows, None)
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield np.loadtxt(chunk, delimiter=delimiter, ndmin=2)
+
+
+def write_predictions(
+    predictions: Iterator[np.ndarray],
+    path: Union[str, Path],
+) -> int:
+    """
+    Write predictions as text, one per line, flushing after every chunk.
+
+    Args:
+        predictions (Iterator[np.ndarray]): Predicted classes per chunk.
+        path (str | Path): Output file, overwritten if it exists.
+
+    Returns:
+        int: Number of predictions written.
+    """
+    n_written = 0
+    with Path(path).open("w") as file:
+        for chunk in predictions:
+            file.writelines(f"{label}\n" for label in chunk)
+            file.flush()
+            n_written += len(chunk)
+    return n_written
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Predict query points with a saved KNNClassifier."
+    )
+    parser.add_argument(
+        "model",
+        type=Path,
+        help="Directory written by the save method of a KNNClassifier or "
+        "a RadiusNeighborsClassifier.",
+    )
+    parser.add_argument(
+        "queries", type=Path, help="A .npy file or a CSV file of points."
+    )
+    parser.add_argument(
+        "output", type=Path, help="Text file with one prediction per line."
+    )
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument(
+        "--skip-rows", type=int, default=0, help="Header lines of a CSV file."
+    )
+    parser.add_argument("--n-jobs", type=int, help="Overrides n_jobs.")
+    args = parser.parse_args(arguments)
+
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1.")
+
+    classifier = KNNClassifier.load(args.model)
+    if args.n_jobs is not None:
+        classifier.n_jobs = args.n_jobs
+
+    chunks = read_chunks(
+        args.queries, args.chunk_size, args.delimiter, args.skip_rows
+    )
+    n_written = write_predictions(classifier.predict(chunks), args.output)
+    print(f"Wrote {n_written} predictions to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Benchmark of the KNNClassifier over a grid of dataset sizes, dimensions, k,
+metrics, algorithms and dtypes.
+
+Every case is fitted and predicted on synthetic gaussian blobs that are
+generated from a fixed seed, so runs on the same machine are comparable. The
+default grid takes a few minutes on one core. The results are written as JSON,
+and a run can be compared with a stored baseline:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --output new.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from itertools import product
+from pathlib import Path
+from typing import Callable, Optional
+
+import numba
+import numpy as np
+
+from knn import ALGORITHMS, DTYPES, KNNClassifier
+
+# Default grid of the benchmark.
+N_TRAIN = [1_000, 10_000]
+N_QUERY = [200]
+N_DIMENSIONS = [2, 16, 64]
+K_VALUES = [10]
+DISTANCE_METRICS = ["euclidean", "manhattan"]
+BENCHMARK_ALGORITHMS = [
+    algorithm for algorithm in ALGORITHMS if algorithm != "auto"
+]
+BENCHMARK_DTYPES = ["float64"]
+
+# Number of timed repetitions of every case, the fastest one is reported.
+N_REPEATS = 3
+
+# Number of gaussian blobs, which are also the classes.
+N_CLASSES = 10
+
+SEED = 0
+
+# Parameters that identify a case, used to match results with a baseline.
+CASE_KEYS = [
+    "n_train",
+    "n_query",
+    "n_dimensions",
+    "k",
+    "distance_metric",
+    "algorithm",
+    "dtype",
+]
+
+# Relative change in time above which a case is reported as a regression.
+REGRESSION_THRESHOLD = 0.1
+
+
+def make_dataset(
+    n_train: int,
+    n_query: int,
+    n_dimensions: int,
+    seed: int = SEED,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gaussian blobs with one class per blob.
+
+    Args:
+        n_train (int): Number of training points.
+        n_query (int): Number of query points, from the same distribution.
+        n_dimensions (int): Number of dimensions.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Training points of shape
+            (n_train, n_dimensions), their labels, and the query points.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 4, (N_CLASSES, n_dimensions))
+    labels = rng.integers(0, N_CLASSES, n_train + n_query)
+    X = centers[labels] + rng.normal(0, 3, (n_train + n_query, n_dimensions))
+    return X[:n_train], labels[:n_train], X[n_train:]
+
+
+def _fastest(
+    function: Callable[[], object],
+    n_repeats: int,
+) -> float:
+    """Shortest wall clock time of n_repeats calls, in seconds."""
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _peak_memory(function: Callable[[], object]) -> float:
+    """
+    Peak memory in MB that is allocated during one call, as traced by
+    tracemalloc. It covers NumPy arrays and Python objects, but not the
+    memory that compiled numba code allocates itself.
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def run_case(
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_query: np.ndarray,
+    k: int,
+    distance_metric: str,
+    algorithm: str,
+    dtype: str,
+    n_repeats: int = N_REPEATS,
+) -> dict:
+    """
+    Time and measure the memory of fit and predict for one case.
+
+    Timing and memory are measured in separate calls, since tracing the
+    allocations slows the code down.
+
+    Returns:
+        dict: The parameters of the case and its measurements, or the reason
+            it was skipped for combinations that the classifier rejects.
+    """
+    result = {
+        "n_train": len(X_train),
+        "n_query": len(X_query),
+        "n_dimensions": X_train.shape[1],
+        "k": k,
+        "distance_metric": distance_metric,
+        "algorithm": algorithm,
+        "dtype": dtype,
+    }
+
+    def make_classifier() -> KNNClassifier:
+        return KNNClassifier(
+            k=k,
+            distance_metric=distance_metric,
+            algorithm=algorithm,
+            dtype=dtype,
+        )
+
+    classifier = make_classifier()
+    try:
+        # Untimed, so that numba compilation and caches are not measured.
+        classifier.fit(X_train, y_train)
+        classifier.predict(X_query[:10])
+    except ValueError as error:
+        result["skipped"] = str(error)
+        return result
+
+    fit_seconds = _fastest(
+        lambda: make_classifier().fit(X_train, y_train), n_repeats
+    )
+    predict_seconds = _fastest(lambda: classifier.predict(X_query), n_repeats)
+
+    result.update(
+        {
+            "fit_seconds": fit_seconds,
+            "predict_seconds": predict_seconds,
+            "fit_points_per_second": len(X_train) / fit_seconds,
+            "predict_queries_per_second": len(X_query) / predict_seconds,
+            "fit_peak_mb": _peak_memory(
+                lambda: make_classifier().fit(X_train, y_train)
+            ),
+            "predict_peak_mb": _peak_memory(
+                lambda: classifier.predict(X_query)
+            ),
+        }
+    )
+    return result
+
+
+def run_benchmark(
+    n_train: list[int] = N_TRAIN,
+    n_query: list[int] = N_QUERY,
+    n_dimensions: list[int] = N_DIMENSIONS,
+    k_values: list[int] = K_VALUES,
+    distance_metrics: list[str] = DISTANCE_METRICS,
+    algorithms: list[str] = BENCHMARK_ALGORITHMS,
+    dtypes: list[str] = BENCHMARK_DTYPES,
+    n_repeats: int = N_REPEATS,
+    verbose: bool = True,
+) -> dict:
+    """
+    Run every combination of the parameters.
+
+    Returns:
+        dict: The environment, the parameters and one result per case, see
+            `run_case`.
+    """
+    results = []
+
+    for n, m, d in product(n_train, n_query, n_dimensions):
+        X_train, y_train, X_query = make_dataset(n, m, d)
+
+        for k, distance_metric, algorithm, dtype in product(
+            k_values, distance_metrics, algorithms, dtypes
+        ):
+            result = run_case(
+                X_train,
+                y_train,
+                X_query,
+                k,
+                distance_metric,
+                algorithm,
+                dtype,
+                n_repeats,
+            )
+            results.append(result)
+
+            if verbose:
+                print(_format_result(result))
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "numba": numba.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": {
+            "n_repeats": n_repeats,
+            "seed": SEED,
+        },
+        "results": results,
+    }
+
+
+def _format_result(result: dict) -> str:
+    """One line summary of a result."""
+    case = " ".join(f"{key}={result[key]}" for key in CASE_KEYS)
+    if "skipped" in result:
+        return f"{case} skipped: {result['skipped']}"
+    return (
+        f"{case} fit={result['fit_seconds']:.4f}s "
+        f"predict={result['predict_seconds']:.4f}s "
+        f"({result['predict_queries_per_second']:.0f} queries/s, "
+        f"peak {result['predict_peak_mb']:.1f} MB)"
+    )
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    threshold: float = REGRESSION_THRESHOLD,
+) -> list[dict]:
+    """
+    Compare the timings of two runs case by case.
+
+    Args:
+        results (dict): Output of `run_benchmark`.
+        baseline (dict): Output of an earlier `run_benchmark`.
+        threshold (float): Relative slowdown above which a case counts as a
+            regression.
+
+    Returns:
+        list[dict]: For every case that was measured in both runs, its
+            parameters, the relative change of the fit and predict time
+            (positive is slower), and whether it regressed.
+    """
+
+    def key(result: dict) -> tuple:
+        return tuple(result[name] for name in CASE_KEYS)
+
+    baseline_results = {
+        key(result): result
+        for result in baseline["results"]
+        if "skipped" not in result
+    }
+
+    comparisons = []
+    for result in results["results"]:
+        old = baseline_results.get(key(result))
+        if old is None or "skipped" in result:
+            continue
+
+        fit_change = result["fit_seconds"] / old["fit_seconds"] - 1
+        predict_change = result["predict_seconds"] / old["predict_seconds"] - 1
+        comparisons.append(
+            {
+                **{name: result[name] for name in CASE_KEYS},
+                "fit_change": fit_change,
+                "predict_change": predict_change,
+                "regression": max(fit_change, predict_change) > threshold,
+            }
+        )
+
+    return comparisons
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the KNNClassifier on synthetic data."
+    )
+    parser.add_argument("--n-train", type=int, nargs="+", default=N_TRAIN)
+    parser.add_argument("--n-query", type=int, nargs="+", default=N_QUERY)
+    parser.add_argument(
+        "--n-dimensions", type=int, nargs="+", default=N_DIMENSIONS
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=K_VALUES)
+    parser.add_argument("--metrics", nargs="+", default=DISTANCE_METRICS)
+    parser.add_argument(
+        "--algorithms",
+        nargs="+",
+        default=BENCHMARK_ALGORITHMS,
+        choices=ALGORITHMS,
+    )
+    parser.add_argument(
+        "--dtypes", nargs="+", default=BENCHMARK_DTYPES, choices=list(DTYPES)
+    )
+    parser.add_argument("--repeats", type=int, default=N_REPEATS)
+    parser.add_argument(
+        "--output", type=Path, help="JSON file to write the results to."
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="JSON file of an earlier run."
+    )
+    args = parser.parse_args(arguments)
+
+    results = run_benchmark(
+        n_train=args.n_train,
+        n_query=args.n_query,
+        n_dimensions=args.n_dimensions,
+        k_values=args.k,
+        distance_metrics=args.metrics,
+        algorithms=args.algorithms,
+        dtypes=args.dtypes,
+        n_repeats=args.repeats,
+    )
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4))
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        comparisons = compare(results, baseline)
+        for comparison in comparisons:
+            case = " ".join(f"{key}={comparison[key]}" for key in CASE_KEYS)
+            flag = " REGRESSION" if comparison["regression"] else ""
+            print(
+                f"{case} fit {comparison['fit_change']:+.1%} "
+                f"predict {comparison['predict_change']:+.1%}{flag}"
+            )
+        n_regressions = sum(c["regression"] for c in comparisons)
+        print(f"{n_regressions} of {len(comparisons)} cases regressed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Arrays that grow geometrically, so appending rows is amortized O(1)."""
+
+import numpy as np
+
+
+def grow(
+    array: np.ndarray,
+    capacity: int,
+    fill_value: float = 0,
+) -> np.ndarray:
+    """Copy an array into a larger one along the first axis."""
+    grown = np.full(
+        (capacity,) + array.shape[1:], fill_value, dtype=array.dtype
+    )
+    grown[: len(array)] = array
+    return grown
+
+
+def reserve(
+    array: np.ndarray,
+    n_needed: int,
+    fill_value: float = 0,
+) -> np.ndarray:
+    """
+    Make room for n_needed rows.
+
+    Args:
+        array (np.ndarray): Buffer whose first axis is the capacity.
+        n_needed (int): Number of rows that must fit.
+        fill_value (float): Value of the new, unused rows.
+
+    Returns:
+        np.ndarray: The array itself when the rows fit and it is writeable,
+            otherwise a copy with at least double the capacity. Arrays that
+            are memory-mapped read-only are copied on the first append.
+    """
+    if n_needed <= len(array) and array.flags.writeable:
+        return array
+    return grow(array, max(n_needed, 2 * len(array)), fill_value)
+
+
+def append(
+    array: np.ndarray,
+    size: int,
+    rows: np.ndarray,
+    fill_value: float = 0,
+) -> np.ndarray:
+    """
+    Write rows behind the first `size` rows of a buffer.
+
+    Args:
+        array (np.ndarray): Buffer whose first `size` rows are in use.
+        size (int): Number of rows in use.
+        rows (np.ndarray): New rows.
+        fill_value (float): Value of unused rows when the buffer grows.
+
+    Returns:
+        np.ndarray: The buffer that holds the size + len(rows) rows, which is
+            a new array when it had to grow.
+    """
+    array = reserve(array, size + len(rows), fill_value)
+    array[size : size + len(rows)] = rows
+    return array
@@ -0,0 +1,210 @@
+"""
+Vectorized distance kernels.
+
+Every kernel takes two arrays of shape (n1, d) and (n2, d) and returns the
+(n1, n2) matrix of distances between their rows. The euclidean and cosine
+kernels are derived from a matrix of dot products, which also makes them usable
+for sparse inputs, see `sparse_matrix`. The other kernels accumulate one
+dimension at a time, so they never allocate an (n1, n2, d) intermediate.
+"""
+
+from functools import partial
+from typing import Callable, Optional
+
+import numpy as np
+
+# Options for the `distance_metric` parameter.
+DISTANCE_METRICS = [
+    "euclidean",
+    "manhattan",
+    "chebyshev",
+    "minkowski",
+    "cosine",
+]
+
+
+def squared_norms(X: np.ndarray) -> np.ndarray:
+    """Squared euclidean norm of every row of X."""
+    return np.einsum("ij,ij->i", X, X)
+
+
+def euclidean_from_products(
+    products: np.ndarray,
+    X1_squared_norms: np.ndarray,
+    X2_squared_norms: np.ndarray,
+) -> np.ndarray:
+    """
+    Euclidean distances using ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2.
+
+    Args:
+        products (np.ndarray): Dot products a.b of shape (n1, n2), which is
+            overwritten with the distances.
+        X1_squared_norms (np.ndarray): Squared norms of shape (n1,).
+        X2_squared_norms (np.ndarray): Squared norms of shape (n2,).
+
+    Returns:
+        np.ndarray: Distance matrix of shape (n1, n2).
+    """
+    products *= -2
+    products += X1_squared_norms[:, np.newaxis]
+    products += X2_squared_norms[np.newaxis, :]
+
+    # Rounding errors can make squared distances slightly negative.
+    np.maximum(products, 0, out=products)
+    return np.sqrt(products, out=products)
+
+
+def cosine_from_products(
+    products: np.ndarray,
+    X1_squared_norms: np.ndarray,
+    X2_squared_norms: np.ndarray,
+) -> np.ndarray:
+    """
+    Cosine distances 1 - a.b / (||a|| ||b||), see `euclidean_from_products`
+    for the arguments. A zero vector has distance 1 to every point.
+    """
+    X1_norms = np.sqrt(X1_squared_norms)
+    X2_norms = np.sqrt(X2_squared_norms)
+    X1_norms[X1_norms == 0] = 1
+    X2_norms[X2_norms == 0] = 1
+
+    products /= X1_norms[:, np.newaxis]
+    products /= X2_norms[np.newaxis, :]
+
+    # Rounding errors can push the similarity slightly outside [-1, 1].
+    np.clip(products, -1, 1, out=products)
+    return np.subtract(1, products, out=products)
+
+
+def euclidean_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+    X2_squared_norms: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Euclidean distances using ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2.
+
+    The whole block is a single matrix multiplication.
+
+    Args:
+        X1 (np.ndarray): Array of shape (n1, d).
+        X2 (np.ndarray): Array of shape (n2, d).
+        X2_squared_norms (np.ndarray, optional): Precomputed squared norms of
+            the rows of X2, for when X2 is reused between calls.
+
+    Returns:
+        np.ndarray: Distance matrix of shape (n1, n2).
+    """
+    if X2_squared_norms is None:
+        X2_squared_norms = squared_norms(X2)
+
+    return euclidean_from_products(
+        X1 @ X2.T, squared_norms(X1), X2_squared_norms
+    )
+
+
+def cosine_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+    X2_squared_norms: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Cosine distances 1 - a.b / (||a|| ||b||), which only depend on the angle
+    between the points. Like `euclidean_distances`, a single matrix
+    multiplication, with optional precomputed squared norms of X2.
+
+    The cosine distance does not satisfy the triangle inequality, so it is
+    not supported by the trees and the grid.
+    """
+    if X2_squared_norms is None:
+        X2_squared_norms = squared_norms(X2)
+
+    return cosine_from_products(X1 @ X2.T, squared_norms(X1), X2_squared_norms)
+
+
+def manhattan_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+) -> np.ndarray:
+    """Sum of absolute coordinate differences, shape (n1, n2)."""
+    distances = np.zeros((len(X1), len(X2)))
+
+    for j in range(X1.shape[1]):
+        distances += np.abs(X1[:, j, np.newaxis] - X2[np.newaxis, :, j])
+
+    return distances
+
+
+def chebyshev_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+) -> np.ndarray:
+    """Largest absolute coordinate difference, shape (n1, n2)."""
+    distances = np.zeros((len(X1), len(X2)))
+
+    for j in range(X1.shape[1]):
+        np.maximum(
+            distances,
+            np.abs(X1[:, j, np.newaxis] - X2[np.newaxis, :, j]),
+            out=distances,
+        )
+
+    return distances
+
+
+def minkowski_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+    p: float,
+) -> np.ndarray:
+    """(sum |a_j - b_j|^p)^(1/p), shape (n1, n2)."""
+    distances = np.zeros((len(X1), len(X2)))
+
+    for j in range(X1.shape[1]):
+        distances += np.abs(X1[:, j, np.newaxis] - X2[np.newaxis, :, j]) ** p
+
+    return distances ** (1 / p)
+
+
+def get_distance_function(
+    distance_metric: str,
+    p: float = 2,
+) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    """
+    Look up the kernel for a metric once, so that callers do not compare
+    metric names for every pair of points.
+
+    Args:
+        distance_metric (str): One of DISTANCE_METRICS.
+        p (float): Order of the minkowski metric. Must be at least 1, otherwise
+            the triangle inequality does not hold. The special cases p=1, p=2
+            and p=inf are mapped to the manhattan, euclidean and chebyshev
+            kernels.
+
+    Returns:
+        Callable: Function mapping (X1, X2) to the (n1, n2) distance matrix.
+    """
+    if distance_metric not in DISTANCE_METRICS:
+        raise ValueError(
+            f"Unknown distance metric '{distance_metric}'. "
+            f"Options are {DISTANCE_METRICS}."
+        )
+
+    if distance_metric == "minkowski":
+        if p < 1:
+            raise ValueError("Parameter 'p' must be at least 1.")
+        if p == 1:
+            distance_metric = "manhattan"
+        elif p == 2:
+            distance_metric = "euclidean"
+        elif np.isinf(p):
+            distance_metric = "chebyshev"
+        else:
+            return partial(minkowski_distances, p=p)
+
+    return {
+        "euclidean": euclidean_distances,
+        "manhattan": manhattan_distances,
+        "chebyshev": chebyshev_distances,
+        "cosine": cosine_distances,
+    }[distance_metric]
@@ -0,0 +1,311 @@
+"""Uniform grid spatial index for exact nearest neighbour queries in 2-D/3-D."""
+
+from itertools import product
+from typing import Callable
+
+import numpy as np
+
+from selection import group_by_row
+
+# Highest number of dimensions the grid is built for. The number of cells in a
+# ring around a query grows as r^(d - 1), so more dimensions are better served
+# by a tree.
+MAX_DIMENSIONS = 3
+
+# Average number of training points per cell that the cell size aims for.
+POINTS_PER_CELL = 8
+
+
+class GridIndex:
+    """
+    Uniform grid of cubic cells over the bounding box of the training points.
+
+    The points are sorted on the cell they fall in, so the points of a cell
+    are a contiguous range `[cell_start[c], cell_start[c + 1])` of
+    `idx_array`. A query searches its own cell and then rings of cells at
+    increasing Chebyshev distance around it. Every point outside the rings
+    searched so far differs from the query by at least the distance to the
+    nearest face of that box in one coordinate, which is a lower bound on the
+    distance in any minkowski metric. The search stops when the k-th best
+    distance is below that bound, so on uniformly dense data a query only
+    looks at the few cells around it.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        points_per_cell: float = POINTS_PER_CELL,
+    ) -> None:
+        """
+        Bin the points into cells.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d), with d at most
+                MAX_DIMENSIONS.
+            distance_function (Callable): Vectorized kernel that is used to
+                compare a query with the points in its cells.
+            points_per_cell (float): Average number of points per cell.
+        """
+        self.X = np.asarray(X, dtype=float)
+        self.distance_function = distance_function
+
+        if len(self.X) == 0:
+            raise ValueError("Cannot build a grid on an empty dataset.")
+        if self.X.shape[1] > MAX_DIMENSIONS:
+            raise ValueError(
+                f"The grid supports at most {MAX_DIMENSIONS} dimensions, use "
+                "algorithm='kd_tree' or 'ball_tree' for more."
+            )
+        if points_per_cell <= 0:
+            raise ValueError("Parameter 'points_per_cell' must be positive.")
+
+        self.origin = self.X.min(axis=0)
+        extent = self.X.max(axis=0) - self.origin
+        self.cell_size = _cell_size(extent, len(self.X) / points_per_cell)
+        self.shape = (extent // self.cell_size).astype(np.int64) + 1
+
+        keys = np.ravel_multi_index(self._cells_of(self.X).T, self.shape)
+        self.idx_array = np.argsort(keys, kind="stable")
+        self.cell_start = np.concatenate(
+            ([0], np.cumsum(np.bincount(keys, minlength=self.shape.prod())))
+        )
+
+        # Offsets of the cells in every ring, created when first needed.
+        self._ring_offsets = {}
+
+    def _cells_of(
+        self,
+        X: np.ndarray,
+    ) -> np.ndarray:
+        """Cell coordinates of shape (n, d), clipped to the grid."""
+        cells = np.floor((X - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.shape - 1)
+
+    def _offsets(
+        self,
+        r: int,
+    ) -> np.ndarray:
+        """Offsets of the cells at Chebyshev distance exactly r."""
+        if r not in self._ring_offsets:
+            offsets = np.array(
+                list(product(range(-r, r + 1), repeat=len(self.shape))),
+                dtype=np.int64,
+            )
+            self._ring_offsets[r] = offsets[np.abs(offsets).max(axis=1) == r]
+        return self._ring_offsets[r]
+
+    def _ring_points(
+        self,
+        cell: np.ndarray,
+        r: int,
+    ) -> np.ndarray:
+        """Indices of the points in the ring of cells at distance r."""
+        cells = cell + self._offsets(r)
+        cells = cells[np.all((cells >= 0) & (cells < self.shape), axis=1)]
+        keys = np.ravel_multi_index(cells.T, self.shape)
+
+        starts, stops = self.cell_start[keys], self.cell_start[keys + 1]
+        lengths = stops - starts
+
+        # Expand the ranges [start, stop) of all cells at once.
+        positions = np.arange(lengths.sum()) + np.repeat(
+            starts - np.cumsum(lengths) + lengths, lengths
+        )
+        return self.idx_array[positions]
+
+    def _ring_bound(
+        self,
+        x: np.ndarray,
+        cell: np.ndarray,
+        r: int,
+    ) -> float:
+        """
+        Lower bound on the distance from x to any point outside the rings
+        0, ..., r, which is infinite once they cover the whole grid.
+        """
+        lower_faces = self.origin + (cell - r) * self.cell_size
+        upper_faces = self.origin + (cell + r + 1) * self.cell_size
+
+        # Faces on the edge of the grid have no points behind them.
+        gaps = np.concatenate(
+            (
+                (x - lower_faces)[cell - r > 0],
+                (upper_faces - x)[cell + r < self.shape - 1],
+            )
+        )
+        return gaps.min(initial=np.inf)
+
+    def _query_single(
+        self,
+        x: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ring search for the k nearest neighbours of one point."""
+        best_distances = np.empty(0)
+        best_idx = np.empty(0, dtype=np.int64)
+        cell = self._cells_of(x[np.newaxis, :])[0]
+        r = 0
+
+        while True:
+            idx = self._ring_points(cell, r)
+
+            if len(idx):
+                distances = self.distance_function(
+                    x[np.newaxis, :], self.X[idx]
+                )[0]
+
+                # Merge with the current best, ties are broken on the index.
+                candidate_distances = np.concatenate(
+                    (best_distances, distances)
+                )
+                candidate_idx = np.concatenate((best_idx, idx))
+                order = np.lexsort((candidate_idx, candidate_distances))[:k]
+                best_distances = candidate_distances[order]
+                best_idx = candidate_idx[order]
+
+            # A point outside the rings at exactly the bound could still win
+            # a tie on its index, so the k-th distance must be strictly lower.
+            bound = self._ring_bound(x, cell, r)
+            if np.isinf(bound) or (
+                len(best_idx) == k and best_distances[-1] < bound
+            ):
+                return best_distances, best_idx
+
+            r += 1
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours. Must not exceed the number of points
+                in the grid.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+                (n_query, k), ordered from nearest to furthest. Equal distances
+                are ordered by index.
+        """
+        if not 1 <= k <= len(self.X):
+            raise ValueError(
+                f"Expected 1 <= k <= {len(self.X)}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=float)
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=int)
+
+        for i, x in enumerate(X):
+            distances[i], indices[i] = self._query_single(x, k)
+
+        return distances, indices
+
+    def query_radius(
+        self,
+        X: np.ndarray,
+        r: float,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all points within distance r of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            r (float): Radius, points at exactly distance r are included.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: CSR-style offsets of
+                shape (n_query + 1,), and the indices and distances of the
+                neighbours of all queries concatenated, see
+                `selection.group_by_row`.
+        """
+        X = np.asarray(X, dtype=float)
+        # Start with empty arrays, so that the concatenation never fails.
+        rows = [np.empty(0, dtype=int)]
+        indices = [np.empty(0, dtype=int)]
+        distances = [np.empty(0)]
+
+        for i, x in enumerate(X):
+            cell = self._cells_of(x[np.newaxis, :])[0]
+            ring = 0
+
+            # Search rings until every unsearched point is further than r.
+            while True:
+                idx = self._ring_points(cell, ring)
+                ring_distances = self.distance_function(
+                    x[np.newaxis, :], self.X[idx]
+                )[0]
+                within = ring_distances <= r
+                rows.append(np.full(np.count_nonzero(within), i))
+                indices.append(idx[within])
+                distances.append(ring_distances[within])
+
+                if self._ring_bound(x, cell, ring) > r:
+                    break
+                ring += 1
+
+        return group_by_row(
+            np.concatenate(rows),
+            np.concatenate(indices),
+            np.concatenate(distances),
+            len(X),
+        )
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Arrays and parameters from which `from_state` rebuilds the grid."""
+        arrays = {
+            "X": self.X,
+            "origin": self.origin,
+            "shape": self.shape,
+            "idx_array": self.idx_array,
+            "cell_start": self.cell_start,
+        }
+        return arrays, {"cell_size": self.cell_size}
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> "GridIndex":
+        """Rebuild a grid from `state`, without copying the arrays."""
+        grid = cls.__new__(cls)
+        grid.distance_function = distance_function
+        grid.cell_size = parameters["cell_size"]
+        grid._ring_offsets = {}
+        for name, array in arrays.items():
+            setattr(grid, name, array)
+        return grid
+
+
+def _cell_size(
+    extent: np.ndarray,
+    n_cells: float,
+) -> float:
+    """
+    Edge length of cubic cells, such that about n_cells cells cover a box with
+    the given extent.
+
+    Dimensions in which the box is thinner than a cell do not multiply the
+    number of cells, so they are left out of the volume until the size is
+    consistent. Otherwise a nearly flat dataset would get a tiny cell size and
+    far too many cells.
+    """
+    flat = extent == 0
+
+    while True:
+        wide = extent[~flat]
+        if len(wide) == 0:
+            return 1.0
+
+        cell_size = (np.prod(wide) / max(n_cells, 1)) ** (1 / len(wide))
+        thin = ~flat & (extent < cell_size)
+        if not thin.any():
+            return float(cell_size)
+        flat |= thin
@@ -0,0 +1,625 @@
+"""
+Hierarchical navigable small world (HNSW) graph index for approximate nearest
+neighbour queries.
+
+The graph is stored in flat arrays so that the search and the insertion can be
+compiled with numba, and so that it can be saved and loaded as plain arrays.
+"""
+
+import heapq
+from pathlib import Path
+from typing import Optional, Union
+
+import numba
+import numpy as np
+
+from buffers import reserve
+from numba_kernels import (
+    EUCLIDEAN,
+    MINKOWSKI,
+    metric_code,
+    reduced_distance,
+)
+from persistence import load_arrays, save_arrays
+
+# Number of links per node on the upper layers. Layer 0 gets 2 * M links.
+M = 16
+
+# Size of the candidate list while inserting a node. Higher values give a
+# better graph at the cost of a slower build.
+EF_CONSTRUCTION = 200
+
+# Default size of the candidate list while searching. Higher values give a
+# higher recall at the cost of slower queries.
+EF_SEARCH = 50
+
+# Initial number of nodes the arrays have room for.
+INITIAL_CAPACITY = 1024
+
+
+@numba.njit(cache=True)
+def _links(
+    node: int,
+    layer: int,
+    links0: np.ndarray,
+    upper_row: np.ndarray,
+    links_upper: np.ndarray,
+) -> np.ndarray:
+    """Links of a node on a layer, padded with -1."""
+    if layer == 0:
+        return links0[node]
+    return links_upper[upper_row[node], layer - 1]
+
+
+@numba.njit(cache=True)
+def _search_layer(
+    data: np.ndarray,
+    query: np.ndarray,
+    entry_points: np.ndarray,
+    ef: int,
+    layer: int,
+    links0: np.ndarray,
+    upper_row: np.ndarray,
+    links_upper: np.ndarray,
+    metric: int,
+    p: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Best-first search on one layer, starting from the entry points.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (at most) ef nearest nodes found and
+            their reduced distances, sorted on distance and then on node id.
+    """
+    visited = set()
+    candidates = []
+    results = []
+
+    for node in entry_points:
+        visited.add(node)
+        distance = reduced_distance(query, data[node], metric, p)
+        candidates.append((distance, node))
+        results.append((-distance, -node))
+
+    heapq.heapify(candidates)
+    heapq.heapify(results)
+    while len(results) > ef:
+        heapq.heappop(results)
+
+    while candidates:
+        distance, node = heapq.heappop(candidates)
+
+        # The results heap holds the furthest result at its root.
+        if distance > -results[0][0]:
+            break
+
+        for neighbor in _links(node, layer, links0, upper_row, links_upper):
+            if neighbor == -1:
+                break
+            if neighbor in visited:
+                continue
+            visited.add(neighbor)
+
+            neighbor_distance = reduced_distance(
+                query, data[neighbor], metric, p
+            )
+            if len(results) < ef or neighbor_distance < -results[0][0]:
+                heapq.heappush(candidates, (neighbor_distance, neighbor))
+                heapq.heappush(results, (-neighbor_distance, -neighbor))
+                if len(results) > ef:
+                    heapq.heappop(results)
+
+    results.sort()
+    n_results = len(results)
+    nodes = np.empty(n_results, dtype=np.int64)
+    distances = np.empty(n_results)
+
+    # Sorted ascending on (-distance, -node), so fill the arrays backwards.
+    for i in range(n_results):
+        distances[n_results - 1 - i] = -results[i][0]
+        nodes[n_results - 1 - i] = -results[i][1]
+
+    return nodes, distances
+
+
+@numba.njit(cache=True)
+def _select_neighbors(
+    data: np.ndarray,
+    candidates: np.ndarray,
+    candidate_distances: np.ndarray,
+    n_links: int,
+    metric: int,
+    p: float,
+) -> np.ndarray:
+    """
+    Heuristic neighbour selection of the HNSW paper.
+
+    Candidates are visited from near to far, and one is kept only if it is
+    closer to the new node than to any neighbour kept so far. This spreads the
+    links over different directions. Remaining slots are filled with the
+    nearest pruned candidates, so the node stays well connected.
+
+    Args:
+        candidates (np.ndarray): Node ids, sorted on distance to the new node.
+        candidate_distances (np.ndarray): Their reduced distances.
+        n_links (int): Maximum number of neighbours to select.
+
+    Returns:
+        np.ndarray: Selected node ids, at most n_links.
+    """
+    selected = np.empty(min(n_links, len(candidates)), dtype=np.int64)
+    is_selected = np.zeros(len(candidates), dtype=np.bool_)
+    n_selected = 0
+
+    for i in range(len(candidates)):
+        if n_selected == len(selected):
+            break
+
+        keep = True
+        for j in range(n_selected):
+            distance = reduced_distance(
+                data[candidates[i]], data[selected[j]], metric, p
+            )
+            if distance < candidate_distances[i]:
+                keep = False
+                break
+
+        if keep:
+            selected[n_selected] = candidates[i]
+            is_selected[i] = True
+            n_selected += 1
+
+    for i in range(len(candidates)):
+        if n_selected == len(selected):
+            break
+        if not is_selected[i]:
+            selected[n_selected] = candidates[i]
+            n_selected += 1
+
+    return selected
+
+
+@numba.njit(cache=True)
+def _connect(
+    data: np.ndarray,
+    node: int,
+    neighbor: int,
+    layer: int,
+    links0: np.ndarray,
+    upper_row: np.ndarray,
+    links_upper: np.ndarray,
+    metric: int,
+    p: float,
+) -> None:
+    """Link neighbor to node, pruning the links of neighbor if they are full."""
+    links = _links(neighbor, layer, links0, upper_row, links_upper)
+
+    for i in range(len(links)):
+        if links[i] == -1:
+            links[i] = node
+            return
+
+    candidates = np.empty(len(links) + 1, dtype=np.int64)
+    candidates[:-1] = links
+    candidates[-1] = node
+    distances = np.empty(len(candidates))
+    for i in range(len(candidates)):
+        distances[i] = reduced_distance(
+            data[neighbor], data[candidates[i]], metric, p
+        )
+
+    order = np.argsort(distances, kind="mergesort")
+    selected = _select_neighbors(
+        data, candidates[order], distances[order], len(links), metric, p
+    )
+    links[:] = -1
+    links[: len(selected)] = selected
+
+
+@numba.njit(cache=True)
+def _insert(
+    data: np.ndarray,
+    levels: np.ndarray,
+    start: int,
+    stop: int,
+    entry_point: int,
+    max_level: int,
+    links0: np.ndarray,
+    upper_row: np.ndarray,
+    links_upper: np.ndarray,
+    m: int,
+    ef_construction: int,
+    metric: int,
+    p: float,
+) -> tuple[int, int]:
+    """
+    Insert the nodes start, ..., stop - 1 into the graph one by one.
+
+    Returns:
+        tuple[int, int]: The new entry point and maximum level.
+    """
+    for node in range(start, stop):
+        level = levels[node]
+
+        if entry_point == -1:
+            entry_point, max_level = node, level
+            continue
+
+        query = data[node]
+        entry_points = np.array([entry_point])
+
+        # Greedy descent through the layers above the level of the node.
+        for layer in range(max_level, level, -1):
+            nodes, _ = _search_layer(
+                data,
+                query,
+                entry_points,
+                1,
+                layer,
+                links0,
+                upper_row,
+                links_upper,
+                metric,
+                p,
+            )
+            entry_points = nodes[:1]
+
+        for layer in range(min(level, max_level), -1, -1):
+            nodes, distances = _search_layer(
+                data,
+                query,
+                entry_points,
+                ef_construction,
+                layer,
+                links0,
+                upper_row,
+                links_upper,
+                metric,
+                p,
+            )
+            selected = _select_neighbors(data, nodes, distances, m, metric, p)
+
+            links = _links(node, layer, links0, upper_row, links_upper)
+            links[: len(selected)] = selected
+            for neighbor in selected:
+                _connect(
+                    data,
+                    node,
+                    neighbor,
+                    layer,
+                    links0,
+                    upper_row,
+                    links_upper,
+                    metric,
+                    p,
+                )
+
+            entry_points = nodes
+
+        if level > max_level:
+            entry_point, max_level = node, level
+
+    return entry_point, max_level
+
+
+@numba.njit(parallel=True, cache=True)
+def _search(
+    data: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    ef: int,
+    entry_point: int,
+    max_level: int,
+    links0: np.ndarray,
+    upper_row: np.ndarray,
+    links_upper: np.ndarray,
+    metric: int,
+    p: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Search the k nearest nodes of every query, in parallel over queries."""
+    n_query = queries.shape[0]
+    distances = np.full((n_query, k), np.inf)
+    indices = np.full((n_query, k), -1, dtype=np.int64)
+
+    for i in numba.prange(n_query):
+        entry_points = np.array([entry_point])
+
+        for layer in range(max_level, 0, -1):
+            nodes, _ = _search_layer(
+                data,
+                queries[i],
+                entry_points,
+                1,
+                layer,
+                links0,
+                upper_row,
+                links_upper,
+                metric,
+                p,
+            )
+            entry_points = nodes[:1]
+
+        nodes, node_distances = _search_layer(
+            data,
+            queries[i],
+            entry_points,
+            max(ef, k),
+            0,
+            links0,
+            upper_row,
+            links_upper,
+            metric,
+            p,
+        )
+        n_found = min(k, len(nodes))
+        indices[i, :n_found] = nodes[:n_found]
+        distances[i, :n_found] = node_distances[:n_found]
+
+        for j in range(n_found):
+            if metric == EUCLIDEAN:
+                distances[i, j] = np.sqrt(distances[i, j])
+            elif metric == MINKOWSKI:
+                distances[i, j] = distances[i, j] ** (1 / p)
+
+    return distances, indices
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph.
+
+    Every node gets a random level, drawn from a geometric distribution, and is
+    linked to its approximate nearest neighbours on every layer up to its
+    level. The sparse upper layers act as an express lane: a query descends
+    greedily from the top to find a good entry point, and then does a
+    best-first search of width ef_search on the dense bottom layer.
+
+    The graph lives in arrays:
+        links0: (capacity, 2 * m) links of every node on layer 0.
+        upper_row: (capacity,) row in links_upper, -1 for nodes on layer 0 only.
+        links_upper: (rows, n_upper_layers, m) links on layers 1 and up.
+    Missing links are -1. All arrays grow geometrically, so inserting points
+    one batch at a time stays cheap.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        distance_metric: str = "euclidean",
+        p: float = 2,
+        m: int = M,
+        ef_construction: int = EF_CONSTRUCTION,
+        ef_search: int = EF_SEARCH,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Build the graph by inserting the points of X.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            distance_metric (str): Metric name, see `distance_metrics`.
+            p (float): Order of the "minkowski" metric.
+            m (int): Number of links per node on the upper layers, 2 * m on
+                layer 0.
+            ef_construction (int): Size of the candidate list while inserting.
+            ef_search (int): Default size of the candidate list while
+                searching.
+            seed (int, optional): Seed for drawing the levels of the nodes.
+        """
+        if m < 2:
+            raise ValueError("Parameter 'm' must be at least 2.")
+
+        X = np.asarray(X, dtype=float)
+
+        self.distance_metric = distance_metric
+        self.p = p
+        self.metric = metric_code(distance_metric, p)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.rng = np.random.default_rng(seed)
+
+        self.size = 0
+        self.entry_point = -1
+        self.max_level = -1
+        self.data = np.empty((INITIAL_CAPACITY, X.shape[1]))
+        self.levels = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.links0 = np.full((INITIAL_CAPACITY, 2 * m), -1, dtype=np.int64)
+        self.upper_row = np.full(INITIAL_CAPACITY, -1, dtype=np.int64)
+        self.links_upper = np.full((0, 0, m), -1, dtype=np.int64)
+        self.n_upper_rows = 0
+
+        self.add(X)
+
+    @property
+    def X(self) -> np.ndarray:
+        """The inserted points, shape (size, d)."""
+        return self.data[: self.size]
+
+    def _reserve(
+        self,
+        levels: np.ndarray,
+    ) -> None:
+        """Grow the arrays geometrically so that the new nodes fit."""
+        n_needed = self.size + len(levels)
+        self.data = reserve(self.data, n_needed, 0.0)
+        self.levels = reserve(self.levels, n_needed, 0)
+        self.links0 = reserve(self.links0, n_needed, -1)
+        self.upper_row = reserve(self.upper_row, n_needed, -1)
+
+        n_upper_needed = self.n_upper_rows + np.count_nonzero(levels)
+        n_upper_layers = max(self.links_upper.shape[1], levels.max(initial=0))
+        if (
+            n_upper_needed > len(self.links_upper)
+            or n_upper_layers > self.links_upper.shape[1]
+            or not self.links_upper.flags.writeable
+        ):
+            links_upper = np.full(
+                (
+                    max(n_upper_needed, 2 * len(self.links_upper)),
+                    n_upper_layers,
+                    self.m,
+                ),
+                -1,
+                dtype=np.int64,
+            )
+            rows, layers, _ = self.links_upper.shape
+            links_upper[:rows, :layers] = self.links_upper
+            self.links_upper = links_upper
+
+    def add(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Insert new points into the graph, without rebuilding it.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d). They get the ids
+                size, ..., size + n - 1.
+        """
+        X = np.asarray(X, dtype=float)
+        if len(X) == 0:
+            return
+
+        # Levels follow a geometric distribution with P(level >= l) = m^-l.
+        uniform = 1 - self.rng.random(len(X))
+        levels = np.floor(-np.log(uniform) / np.log(self.m)).astype(np.int64)
+        self._reserve(levels)
+
+        start, stop = self.size, self.size + len(X)
+        self.data[start:stop] = X
+        self.levels[start:stop] = levels
+
+        upper_nodes = start + np.flatnonzero(levels)
+        self.upper_row[upper_nodes] = self.n_upper_rows + np.arange(
+            len(upper_nodes)
+        )
+        self.n_upper_rows += len(upper_nodes)
+        self.size = stop
+
+        self.entry_point, self.max_level = _insert(
+            self.data,
+            self.levels,
+            start,
+            stop,
+            self.entry_point,
+            self.max_level,
+            self.links0,
+            self.upper_row,
+            self.links_upper,
+            self.m,
+            self.ef_construction,
+            self.metric,
+            float(self.p),
+        )
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+        ef_search: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find approximately the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours, at most the number of points.
+            ef_search (int, optional): Size of the candidate list, overrides
+                the default of the index. At least k is used.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+                (n_query, k), ordered from nearest to furthest.
+        """
+        if not 1 <= k <= self.size:
+            raise ValueError(f"Expected 1 <= k <= {self.size}, but got k={k}.")
+
+        return _search(
+            self.data,
+            np.ascontiguousarray(X, dtype=float),
+            k,
+            ef_search or self.ef_search,
+            self.entry_point,
+            self.max_level,
+            self.links0,
+            self.upper_row,
+            self.links_upper,
+            self.metric,
+            float(self.p),
+        )
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """
+        Arrays and parameters from which `from_state` rebuilds the graph.
+
+        Only the used part of every array is included: the points, their
+        levels and their links.
+        """
+        arrays = {
+            "data": self.X,
+            "levels": self.levels[: self.size],
+            "links0": self.links0[: self.size],
+            "upper_row": self.upper_row[: self.size],
+            "links_upper": self.links_upper[: self.n_upper_rows],
+        }
+        parameters = {
+            "distance_metric": self.distance_metric,
+            "p": self.p,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "entry_point": self.entry_point,
+            "max_level": self.max_level,
+        }
+        return arrays, parameters
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+    ) -> "HNSWIndex":
+        """Rebuild a graph from `state`, without copying the arrays."""
+        index = cls.__new__(cls)
+        index.distance_metric = parameters["distance_metric"]
+        index.p = parameters["p"]
+        index.metric = metric_code(index.distance_metric, index.p)
+        index.m = parameters["m"]
+        index.ef_construction = parameters["ef_construction"]
+        index.ef_search = parameters["ef_search"]
+        index.rng = np.random.default_rng()
+        index.entry_point = parameters["entry_point"]
+        index.max_level = parameters["max_level"]
+
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        index.size = len(index.data)
+        index.n_upper_rows = len(index.links_upper)
+
+        return index
+
+    def save(
+        self,
+        path: Union[str, Path],
+    ) -> None:
+        """Save the graph as a directory of raw arrays, see `persistence`."""
+        save_arrays(path, *self.state())
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        mmap: bool = True,
+    ) -> "HNSWIndex":
+        """
+        Load a graph that was written with `save`.
+
+        Args:
+            path (str | Path): Directory that was written with `save`.
+            mmap (bool): Memory-map the arrays instead of reading them. The
+                graph can still be queried and extended, the arrays are copied
+                when the first point is added.
+        """
+        return cls.from_state(*load_arrays(path, mmap))
@@ -0,0 +1,199 @@
+"""
+Opt-in timing and counters for the phases of KNNClassifier.predict.
+
+PredictStats does not change the classifier itself.
+`KNNClassifier.enable_stats` shadows the methods of the phases with timed
+wrappers on the instance, and `disable_stats` removes them again, so a
+classifier without statistics runs the plain methods of its class.
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from functools import wraps
+from typing import Any
+
+import numpy as np
+
+# Phases that are timed, from outer to inner. "predict" is a whole batch,
+# "neighbors" the search for the nearest neighbours of a tile of queries,
+# which includes the "distance" computations, and "vote" the majority vote.
+PHASES = ["predict", "neighbors", "distance", "vote"]
+
+
+class PredictStats:
+    """
+    Cumulative wall time per phase and counts of distance evaluations.
+
+    Tiles are predicted on several threads when n_jobs > 1, so the counters
+    are updated under a lock, and the times of concurrent tiles add up.
+    """
+
+    def __init__(self) -> None:
+        """Initialising the PredictStats class."""
+        self._lock = threading.Lock()
+        # Counters of the index query that runs on this thread, see
+        # `track_index`.
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """Set every time and counter to zero."""
+        with self._lock:
+            self.seconds = dict.fromkeys(PHASES, 0.0)
+            self.calls = dict.fromkeys(PHASES, 0)
+            self.n_queries = 0
+            self.distances_evaluated = 0
+            self.index_candidates = 0
+            self.index_distances = 0
+
+    def add(
+        self,
+        phase: str,
+        seconds: float,
+        **counts: int,
+    ) -> None:
+        """Add the time of one call of a phase and increase counters."""
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += 1
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def timed(
+        self,
+        phase: str,
+        method: Callable,
+        count: Callable[[tuple, Any], dict] = lambda args, result: {},
+    ) -> Callable:
+        """
+        Wrap a method so that its wall time is added to a phase.
+
+        Args:
+            phase (str): One of PHASES.
+            method (Callable): Bound method to wrap.
+            count (Callable): Maps the positional arguments and the result of
+                a call to the counters that it increases.
+
+        Returns:
+            Callable: The wrapper, with the same signature as the method.
+        """
+
+        @wraps(method)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            self.add(phase, seconds, **count(args, result))
+            return result
+
+        return wrapper
+
+    def _counted(
+        self,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        """
+        Wrap the distance function of an index, so that the calls made inside
+        `track_index` are timed and counted for the current thread.
+        """
+
+        @wraps(distance_function)
+        def wrapper(*args: Any, **kwargs: Any) -> np.ndarray:
+            local = self._local
+            if not getattr(local, "tracking", False):
+                return distance_function(*args, **kwargs)
+
+            start = time.perf_counter()
+            distances = distance_function(*args, **kwargs)
+            local.seconds += time.perf_counter() - start
+            local.n_calls += 1
+            local.n_distances += distances.size
+            return distances
+
+        wrapper.counted_by = self
+        return wrapper
+
+    def count_distances(self, index: Any) -> bool:
+        """
+        Replace the distance function of an index by a counted one, once.
+
+        Returns:
+            bool: Whether the index computes its distances with a distance
+                function that can be counted.
+        """
+        with self._lock:
+            function = getattr(index, "distance_function", None)
+            if function is None:
+                return False
+            if getattr(function, "counted_by", None) is not self:
+                index.distance_function = self._counted(function)
+            return True
+
+    @staticmethod
+    def uncount_distances(index: Any) -> None:
+        """Restore the distance function of an index, see `count_distances`."""
+        function = getattr(index, "distance_function", None)
+        if hasattr(function, "counted_by"):
+            index.distance_function = function.__wrapped__
+
+    def track_index(
+        self,
+        query: Callable[[], Any],
+        n_candidates: int,
+    ) -> Any:
+        """
+        Call a query of an index whose distances are counted, and add the
+        time and number of its distance evaluations to the "distance" phase.
+
+        Args:
+            query (Callable): Runs the query and returns its result.
+            n_candidates (int): Number of (query, indexed point) pairs that
+                brute force would compare.
+
+        Returns:
+            The result of the query.
+        """
+        local = self._local
+        local.tracking = True
+        local.seconds = 0.0
+        local.n_calls = 0
+        local.n_distances = 0
+        try:
+            result = query()
+        finally:
+            local.tracking = False
+
+        with self._lock:
+            self.seconds["distance"] += local.seconds
+            self.calls["distance"] += local.n_calls
+            self.distances_evaluated += local.n_distances
+            self.index_distances += local.n_distances
+            self.index_candidates += n_candidates
+        return result
+
+    def as_dict(self) -> dict:
+        """
+        The statistics as plain numbers.
+
+        Returns:
+            dict: "seconds" and "calls" per phase, the number of predicted
+                queries, the number of distances evaluated, and for the
+                indices whose distance evaluations are counted (kd_tree,
+                ball_tree, grid and lsh), the number of (query, indexed
+                point) pairs they were asked about and how many of those were
+                pruned without computing their distance. The distances of the
+                ball tree include those to the centroids of visited balls, so
+                its pruned count is a lower bound.
+        """
+        with self._lock:
+            return {
+                "seconds": dict(self.seconds),
+                "calls": dict(self.calls),
+                "n_queries": self.n_queries,
+                "distances_evaluated": self.distances_evaluated,
+                "index_candidates": self.index_candidates,
+                "candidates_pruned": max(
+                    self.index_candidates - self.index_distances, 0
+                ),
+            }
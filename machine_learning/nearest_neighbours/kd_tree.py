@@ -0,0 +1,302 @@
+"""KD-tree spatial index for exact euclidean nearest neighbour queries."""
+
+import numpy as np
+
+from selection import group_by_row
+
+# Maximum number of points stored in a leaf node.
+LEAF_SIZE = 40
+
+
+def leaf_distances(
+    X1: np.ndarray,
+    X2: np.ndarray,
+) -> np.ndarray:
+    """
+    Euclidean distances between every row of X1 and every row of X2, summed
+    from the coordinate differences. A leaf holds few points, so this is not
+    slower than the norm expansion, and it is exact for coincident points.
+
+    Returns:
+        np.ndarray: Distance matrix of shape (n1, n2).
+    """
+    differences = X1[:, np.newaxis, :] - X2[np.newaxis, :, :]
+    return np.sqrt(np.sum(differences**2, axis=2))
+
+
+class KDTree:
+    """
+    KD-tree over a fixed set of points.
+
+    The tree is stored as flat node arrays instead of node objects. Every node
+    owns a contiguous range `[node_start, node_end)` of `idx_array`, which is a
+    permutation of the training indices, and an axis-aligned bounding box that
+    is used to prune whole subtrees during a query.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        leaf_size: int = LEAF_SIZE,
+    ) -> None:
+        """
+        Build the tree.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            leaf_size (int): Maximum number of points in a leaf node.
+        """
+        if leaf_size < 1:
+            raise ValueError("Parameter 'leaf_size' must be at least 1.")
+
+        self.X = np.asarray(X, dtype=float)
+        self.leaf_size = leaf_size
+        # An attribute like the distance function of BallTree, so that the
+        # distances evaluated in the leaves can be counted, see
+        # `instrumentation`.
+        self.distance_function = leaf_distances
+        self.idx_array = np.arange(len(self.X))
+
+        self.node_start = []
+        self.node_end = []
+        self.node_left = []
+        self.node_right = []
+        self.node_lower_bounds = []
+        self.node_upper_bounds = []
+
+        self._build()
+
+    def _add_node(
+        self,
+        start: int,
+        end: int,
+    ) -> int:
+        """Register a node that owns idx_array[start:end] and return its id."""
+        points = self.X[self.idx_array[start:end]]
+
+        self.node_start.append(start)
+        self.node_end.append(end)
+        self.node_left.append(-1)
+        self.node_right.append(-1)
+        self.node_lower_bounds.append(points.min(axis=0))
+        self.node_upper_bounds.append(points.max(axis=0))
+
+        return len(self.node_start) - 1
+
+    def _build(self) -> None:
+        """Recursively split nodes on the dimension with the largest spread."""
+        if len(self.X) == 0:
+            raise ValueError("Cannot build a KD-tree on an empty dataset.")
+
+        stack = [self._add_node(0, len(self.X))]
+
+        while stack:
+            node = stack.pop()
+            start, end = self.node_start[node], self.node_end[node]
+
+            if end - start <= self.leaf_size:
+                continue
+
+            spread = self.node_upper_bounds[node] - self.node_lower_bounds[node]
+            split_dimension = int(np.argmax(spread))
+            if spread[split_dimension] == 0:
+                # All points in this node coincide, so it stays a leaf.
+                continue
+
+            # Partially sort the node's points around the median value.
+            middle = (end - start) // 2
+            node_idx = self.idx_array[start:end]
+            order = np.argpartition(self.X[node_idx, split_dimension], middle)
+            self.idx_array[start:end] = node_idx[order]
+
+            left = self._add_node(start, start + middle)
+            right = self._add_node(start + middle, end)
+            self.node_left[node] = left
+            self.node_right[node] = right
+            stack.extend((left, right))
+
+        self.node_start = np.array(self.node_start)
+        self.node_end = np.array(self.node_end)
+        self.node_left = np.array(self.node_left)
+        self.node_right = np.array(self.node_right)
+        self.node_lower_bounds = np.array(self.node_lower_bounds)
+        self.node_upper_bounds = np.array(self.node_upper_bounds)
+
+    def _min_distance_to_node(
+        self,
+        x: np.ndarray,
+        node: int,
+    ) -> float:
+        """Lower bound on the distance from x to any point inside a node."""
+        gap = np.maximum(
+            self.node_lower_bounds[node] - x, x - self.node_upper_bounds[node]
+        )
+        return np.sqrt(np.sum(np.maximum(gap, 0) ** 2))
+
+    def _query_single(
+        self,
+        x: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Depth-first search for the k nearest neighbours of one point."""
+        best_distances = np.full(k, np.inf)
+        best_idx = np.full(k, -1)
+        stack = [(0, 0.0)]
+
+        while stack:
+            node, min_distance = stack.pop()
+
+            # Nodes that are further away than the current k-th neighbour
+            # cannot contain a better candidate.
+            if min_distance > best_distances[-1]:
+                continue
+
+            left, right = self.node_left[node], self.node_right[node]
+
+            if left == -1:
+                idx = self.idx_array[
+                    self.node_start[node] : self.node_end[node]
+                ]
+                distances = self.distance_function(
+                    x[np.newaxis, :], self.X[idx]
+                )[0]
+
+                # Merge with the current best, ties are broken on the index.
+                candidate_distances = np.concatenate(
+                    (best_distances, distances)
+                )
+                candidate_idx = np.concatenate((best_idx, idx))
+                order = np.lexsort((candidate_idx, candidate_distances))[:k]
+                best_distances = candidate_distances[order]
+                best_idx = candidate_idx[order]
+                continue
+
+            left_distance = self._min_distance_to_node(x, left)
+            right_distance = self._min_distance_to_node(x, right)
+
+            # Push the nearer child last so that it is visited first.
+            if left_distance <= right_distance:
+                stack.append((right, right_distance))
+                stack.append((left, left_distance))
+            else:
+                stack.append((left, left_distance))
+                stack.append((right, right_distance))
+
+        return best_distances, best_idx
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours. Must not exceed the number of points
+                in the tree.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+                (n_query, k), ordered from nearest to furthest. Equal distances
+                are ordered by index.
+        """
+        if not 1 <= k <= len(self.X):
+            raise ValueError(
+                f"Expected 1 <= k <= {len(self.X)}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=float)
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=int)
+
+        for i, x in enumerate(X):
+            distances[i], indices[i] = self._query_single(x, k)
+
+        return distances, indices
+
+    def query_radius(
+        self,
+        X: np.ndarray,
+        r: float,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all points within distance r of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            r (float): Radius, points at exactly distance r are included.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: CSR-style offsets of
+                shape (n_query + 1,), and the indices and distances of the
+                neighbours of all queries concatenated, see
+                `selection.group_by_row`.
+        """
+        X = np.asarray(X, dtype=float)
+        # Start with empty arrays, so that the concatenation never fails.
+        rows = [np.empty(0, dtype=int)]
+        indices = [np.empty(0, dtype=int)]
+        distances = [np.empty(0)]
+
+        for i, x in enumerate(X):
+            stack = [0]
+
+            while stack:
+                node = stack.pop()
+
+                if self._min_distance_to_node(x, node) > r:
+                    continue
+
+                left, right = self.node_left[node], self.node_right[node]
+
+                if left == -1:
+                    idx = self.idx_array[
+                        self.node_start[node] : self.node_end[node]
+                    ]
+                    node_distances = self.distance_function(
+                        x[np.newaxis, :], self.X[idx]
+                    )[0]
+                    within = node_distances <= r
+                    rows.append(np.full(np.count_nonzero(within), i))
+                    indices.append(idx[within])
+                    distances.append(node_distances[within])
+                    continue
+
+                stack.extend((left, right))
+
+        return group_by_row(
+            np.concatenate(rows),
+            np.concatenate(indices),
+            np.concatenate(distances),
+            len(X),
+        )
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Arrays and parameters from which `from_state` rebuilds the tree."""
+        arrays = {
+            "X": self.X,
+            "idx_array": self.idx_array,
+            "node_start": self.node_start,
+            "node_end": self.node_end,
+            "node_left": self.node_left,
+            "node_right": self.node_right,
+            "node_lower_bounds": self.node_lower_bounds,
+            "node_upper_bounds": self.node_upper_bounds,
+        }
+        return arrays, {"leaf_size": self.leaf_size}
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+    ) -> "KDTree":
+        """Rebuild a tree from `state`, without copying the arrays."""
+        tree = cls.__new__(cls)
+        tree.leaf_size = parameters["leaf_size"]
+        tree.distance_function = leaf_distances
+        for name, array in arrays.items():
+            setattr(tree, name, array)
+        return tree
@@ -0,0 +1,1591 @@
+"""Classification according to the k-nearest neighbours algorithm."""
+
+import os
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from ball_tree import BallTree
+from buffers import append
+from distance_metrics import (
+    cosine_distances,
+    euclidean_distances,
+    get_distance_function,
+    squared_norms,
+)
+from grid_index import GridIndex
+from instrumentation import PredictStats
+from kd_tree import KDTree, LEAF_SIZE
+from lsh import LSHIndex
+from persistence import load_arrays, save_arrays
+from product_quantization import ProductQuantizationIndex
+from scalar_quantization import ScalarQuantizationIndex
+from selection import group_by_row, merge_top_k, select_top_k
+from sparse_matrix import (
+    CSRMatrix,
+    SPARSE_METRICS,
+    as_csr,
+    is_sparse,
+    sparse_distances,
+)
+from training_source import ArraySource, ChunkSource, PREFETCH_DEPTH, prefetch
+
+# numba, numba_kernels, hnsw and the thread pool are imported by the methods
+# that use them. Importing numba takes several times longer than NumPy, and
+# batch jobs that do not use the compiled algorithms should not pay for it.
+
+# Default memory budget for one query x train tile during predict.
+MAX_MEMORY_MB = 256
+
+# Peak number of bytes held per distance in a tile: the float64 distance block,
+# the temporaries of the distance kernel and the candidates that are merged
+# into the running top-k.
+BYTES_PER_DISTANCE = 40
+
+# Options for the `algorithm` parameter of the KNNClassifier.
+ALGORITHMS = [
+    "auto",
+    "brute",
+    "numba",
+    "kd_tree",
+    "ball_tree",
+    "grid",
+    "lsh",
+    "hnsw",
+    "pq",
+]
+
+# Options for the `dtype` parameter, and the float type of the stored points.
+DTYPES = {
+    "float64": np.float64,
+    "float32": np.float32,
+    "int8": np.float32,
+}
+
+# Algorithms that compute in float32. The indices convert points to float64.
+FLOAT32_ALGORITHMS = ["auto", "brute", "numba"]
+
+# Number of points that are shifted by the offset and converted at once.
+SHIFT_CHUNK_SIZE = 65_536
+
+# partial_fit moves the offset to the mean of the training points once they
+# are further apart than this multiple of the root mean square spread.
+RECENTER_DRIFT = 1.0
+
+# Heuristic for algorithm="auto". A tree only prunes well when there are many
+# more training points than the 2^d regions it splits space into, below that a
+# vectorized brute force scan is faster than descending a tree in Python.
+TREE_MAX_DIMENSIONS = 8
+TREE_SAMPLES_PER_REGION = 1000
+
+# Metrics whose kernel can reuse the squared norms of the training points.
+NORM_METRICS = [euclidean_distances, cosine_distances]
+
+# Algorithms whose index can insert new points, see `partial_fit`.
+INCREMENTAL_ALGORITHMS = ["lsh", "hnsw", "pq", "int8"]
+
+# Algorithms whose index answers radius queries. The others scan the training
+# points for them.
+RADIUS_ALGORITHMS = ["kd_tree", "ball_tree", "grid"]
+
+# Options for the `cv` parameter of `select_k`.
+CV_METHODS = ["loo"]
+
+# Index class of every algorithm that builds one, used by `load`. The
+# HNSWIndex is looked up in `_index_class`, since it needs numba.
+INDEX_CLASSES = {
+    "kd_tree": KDTree,
+    "ball_tree": BallTree,
+    "grid": GridIndex,
+    "lsh": LSHIndex,
+    "pq": ProductQuantizationIndex,
+    # Not an option of `algorithm`, but what dtype="int8" resolves to.
+    "int8": ScalarQuantizationIndex,
+}
+
+
+def _index_class(
+    algorithm: str,
+) -> Optional[type]:
+    """Index class of an algorithm, or None if it does not build one."""
+    if algorithm == "hnsw":
+        from hnsw import HNSWIndex
+
+        return HNSWIndex
+    return INDEX_CLASSES.get(algorithm)
+
+
+def _classifier_class(
+    name: str,
+) -> type:
+    """
+    Classifier class of a saved model. RadiusNeighborsClassifier is imported
+    here, since its module imports this one.
+    """
+    if name == "KNNClassifier":
+        return KNNClassifier
+    if name == "RadiusNeighborsClassifier":
+        from radius_neighbors import RadiusNeighborsClassifier
+
+        return RadiusNeighborsClassifier
+    raise ValueError(f"Unknown classifier class '{name}'.")
+
+
+def _shifted(
+    X: np.ndarray,
+    offset: np.ndarray,
+    dtype: type,
+) -> np.ndarray:
+    """
+    Subtract an offset from points in float64 and convert the result, chunk
+    by chunk so that no float64 copy of all points is made.
+    """
+    X = np.asarray(X)
+    shifted = np.empty(X.shape, dtype=dtype)
+    for start in range(0, len(X), SHIFT_CHUNK_SIZE):
+        rows = slice(start, start + SHIFT_CHUNK_SIZE)
+        shifted[rows] = X[rows] - offset
+    return shifted
+
+
+class KNNClassifier:
+    """Class for classification according to the KNN-algorithm."""
+
+    def __init__(
+        self,
+        k: int,
+        distance_metric: str = "euclidean",
+        algorithm: str = "auto",
+        leaf_size: int = LEAF_SIZE,
+        p: float = 2,
+        n_jobs: int = 1,
+        index_params: Optional[dict] = None,
+        cache_k: int = 0,
+        dtype: str = "float64",
+    ) -> None:
+        """
+        Initialising the KNNClassifier class.
+
+        Args:
+            k (int): Number of neighbours that vote on the predicted class.
+            distance_metric (str): Distance metric. Options are "euclidean",
+                "manhattan", "chebyshev", "minkowski" and "cosine". The cosine
+                distance is not supported by "kd_tree", "ball_tree", "grid",
+                "numba", "hnsw" and "pq".
+            algorithm (str): Method used to find the nearest neighbours.
+                Options are "brute" (compare every query with every training
+                point), "numba" (brute force in a compiled kernel that fuses
+                the distance computation with a k-heap per query, so no
+                distance arrays are allocated), "kd_tree" (build a KD-tree at
+                fit time and prune whole regions of space during a query,
+                euclidean only), "ball_tree" (like "kd_tree", but with balls
+                instead of boxes so that it works for every metric), "grid"
+                (bin 2-D or 3-D points into a uniform grid and search rings of
+                cells around a query, for dense low-dimensional data), "lsh"
+                (approximate, only compare with the points that share a
+                locality-sensitive hash bucket), "hnsw" (approximate, search
+                a hierarchical navigable small world graph, for low latency
+                on millions of training points), "pq" (approximate, store the
+                training points as product-quantized codes of a few bytes
+                each, euclidean only) or "auto" (choose an exact
+                algorithm based on the metric and the number of training
+                points and dimensions).
+            leaf_size (int): Maximum number of points in a leaf of a tree.
+            p (float): Order of the "minkowski" metric, at least 1.
+            n_jobs (int): Number of threads that predict query tiles in
+                parallel, -1 uses all cores. The threads share the training
+                arrays instead of copying them, and NumPy releases the GIL
+                while computing distances and selecting neighbours. The trees
+                are descended in Python, so they do not benefit from this.
+                For algorithm="numba" and "hnsw" it sets the number of numba
+                threads.
+            index_params (dict, optional): Extra keyword arguments for the
+                index of the approximate algorithms, for example
+                {"points_per_cell": 8} for GridIndex,
+                {"n_tables": 16, "n_bits": 10} for LSHIndex,
+                {"m": 16, "ef_construction": 200, "ef_search": 50} for
+                HNSWIndex, or {"n_subspaces": 8, "rerank": 0} for
+                ProductQuantizationIndex.
+            cache_k (int): Number of neighbours to remember per query point,
+                0 disables the cache. predict then finds the
+                max(k, cache_k) nearest neighbours once, and a later call on
+                the same queries with any k up to that reuses them, so only
+                the vote is repeated. The cache is cleared when the training
+                data changes.
+            dtype (str): Precision of the stored training points and of the
+                distance computations. Options are "float64", "float32" (half
+                the memory and memory bandwidth, for algorithm "brute",
+                "numba" or "auto", which then resolves to "brute") or "int8"
+                (approximate, scan int8 codes of the training points with
+                brute force and re-rank the best candidates per query with
+                their float32 points, euclidean only, see
+                ScalarQuantizationIndex and {"rerank": 32} for index_params).
+                See readme.md for their accuracy.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(
+                f"Unknown algorithm '{algorithm}'. Options are {ALGORITHMS}."
+            )
+        if dtype not in DTYPES:
+            raise ValueError(
+                f"Unknown dtype '{dtype}'. Options are {list(DTYPES)}."
+            )
+
+        self.k = k
+        self.distance_metric = distance_metric
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.p = p
+        self.n_jobs = n_jobs
+        self.index_params = index_params or {}
+        self.cache_k = cache_k
+        self.dtype = dtype
+        self.distance_function = get_distance_function(distance_metric, p)
+
+        self.X_train = None
+        self.n_train = 0
+        # Number of dimensions of the training points. For a ChunkSource it is
+        # only known after the first scan.
+        self.n_dimensions = None
+        self.classes = None
+        self.y_train_encoded = None
+        self.X_train_squared_norms = None
+        self.fitted_algorithm = None
+        self.index = None
+        # Number of training points in the index, the rest is scanned directly.
+        self.n_indexed = 0
+
+        # Buffers behind X_train, y_train_encoded and X_train_squared_norms,
+        # with room to append points in partial_fit.
+        self._X_buffer = None
+        self._y_buffer = None
+        self._norms_buffer = None
+
+        # Query points and their cached neighbours, see `cache_k`.
+        self._neighbor_cache = None
+
+        # Out-of-core training points, see `fit`.
+        self.training_source = None
+
+        # Timing and counters of predict, see `enable_stats`.
+        self._stats = None
+
+        # Point that is subtracted from the training and query points before
+        # they are stored, see `_shift`. None for the cosine distance and for
+        # sparse or out-of-core training points.
+        self.offset = None
+        # Mean of all training points and their sum of squared distances to
+        # the offset, which tell partial_fit when to move the offset.
+        self._mean = None
+        self._offset_sum_squares = 0.0
+
+    def _choose_algorithm(
+        self,
+        n_samples: int,
+        n_dimensions: int,
+    ) -> str:
+        """Resolve algorithm="auto" to a concrete algorithm."""
+        if self.dtype == "int8":
+            if self.algorithm not in ["auto", "brute"]:
+                raise ValueError(
+                    "dtype='int8' scans with brute force, so it only supports "
+                    "algorithm='auto' and 'brute'."
+                )
+            return "int8"
+        if self.dtype == "float32" and self.algorithm not in FLOAT32_ALGORITHMS:
+            raise ValueError(
+                f"dtype='float32' only supports the algorithms "
+                f"{FLOAT32_ALGORITHMS}."
+            )
+
+        if self.algorithm != "auto":
+            return self.algorithm
+        if self.dtype == "float32":
+            return "brute"
+
+        if (
+            n_dimensions <= TREE_MAX_DIMENSIONS
+            and n_samples >= TREE_SAMPLES_PER_REGION * 2**n_dimensions
+        ):
+            if self.distance_function is euclidean_distances:
+                return "kd_tree"
+            if self.distance_function is not cosine_distances:
+                return "ball_tree"
+
+        return "brute"
+
+    def _compute_distance(
+        self,
+        X1: np.ndarray,
+        X2: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Compute the distances between every row of X1 and every row of X2.
+
+        The metric's vectorized kernel is resolved once in __init__, so the
+        whole block is computed without a Python call per pair of points.
+
+        Args:
+            X1 (np.ndarray): Array of shape (n1, d).
+            X2 (np.ndarray): Array of shape (n2, d).
+
+        Returns:
+            np.ndarray: Distance matrix of shape (n1, n2).
+        """
+        if isinstance(X2, CSRMatrix):
+            return sparse_distances(
+                X1,
+                X2,
+                self.distance_metric,
+                self.X_train_squared_norms if X2 is self.X_train else None,
+            )
+
+        if X2 is self.X_train and self.X_train_squared_norms is not None:
+            return self.distance_function(
+                X1, X2, X2_squared_norms=self.X_train_squared_norms
+            )
+
+        return self.distance_function(X1, X2)
+
+    def _get_neighbors(
+        self,
+        X: np.ndarray,
+        train_chunk_size: Optional[int] = None,
+        k: Optional[int] = None,
+        exact: bool = False,
+    ) -> np.ndarray:
+        """
+        Find the indices of the k nearest training points for each query.
+
+        Without an index, the training set is scanned in chunks of
+        `train_chunk_size` points and only a running top-k is kept per query,
+        so at most (n_query, train_chunk_size) distances exist at a time.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            train_chunk_size (int, optional): Number of training points per
+                distance block. Defaults to the whole training set.
+            k (int, optional): Number of neighbours, defaults to self.k.
+            exact (bool): Scan the training set by brute force, even when the
+                classifier was fitted with an index or compiled kernel.
+
+        Returns:
+            np.ndarray: Indices into X_train of shape (n_query, k), ordered
+                from nearest to furthest.
+        """
+        k = min(self.k if k is None else k, self.n_train)
+
+        if self.fitted_algorithm == "numba" and not exact:
+            from numba_kernels import fused_k_nearest, metric_code
+
+            _, neighbors_idx = fused_k_nearest(
+                np.ascontiguousarray(X),
+                self.X_train,
+                k,
+                metric_code(self.distance_metric, self.p),
+                float(self.p),
+            )
+            return neighbors_idx
+
+        if self.index is not None and not exact:
+            distances, neighbors_idx = self.index.query(
+                X, min(k, self.n_indexed)
+            )
+            if self.n_indexed < self.n_train:
+                # Points added after the index was built are scanned directly.
+                distances, neighbors_idx = merge_top_k(
+                    distances,
+                    neighbors_idx,
+                    self._compute_distance(X, self.X_train[self.n_indexed :]),
+                    np.arange(self.n_indexed, self.n_train),
+                    k,
+                )
+
+            # A graph search that reaches fewer than k nodes pads its result
+            # with -1, those queries fall back to an exact scan.
+            incomplete = (neighbors_idx < 0).any(axis=1)
+            if incomplete.any():
+                neighbors_idx[incomplete] = self._get_neighbors(
+                    X[incomplete], train_chunk_size, k, exact=True
+                )
+            return neighbors_idx
+
+        n_train = self.n_train
+        train_chunk_size = train_chunk_size or n_train
+
+        if train_chunk_size >= n_train:
+            distances = self._compute_distance(X, self.X_train)
+            _, neighbors_idx = select_top_k(distances, np.arange(n_train), k)
+            return neighbors_idx
+
+        best_distances = np.full((len(X), k), np.inf)
+        best_idx = np.full((len(X), k), -1)
+
+        for start in range(0, n_train, train_chunk_size):
+            stop = min(start + train_chunk_size, n_train)
+            distances = self._compute_distance(X, self.X_train[start:stop])
+            best_distances, best_idx = merge_top_k(
+                best_distances,
+                best_idx,
+                distances,
+                np.arange(start, stop),
+                k,
+            )
+
+        return best_idx
+
+    def _vote(
+        self,
+        neighbors_idx: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Majority vote over the neighbours of every query at once.
+
+        Classes are counted with a single bincount over the (n_query, k) matrix
+        of encoded labels. When several classes get the same number of votes,
+        the class of the nearest neighbour among them wins.
+
+        Args:
+            neighbors_idx (np.ndarray): Indices into X_train of shape
+                (n_query, k), ordered from nearest to furthest.
+
+        Returns:
+            np.ndarray: Encoded predicted class of every query, of shape
+                (n_query,).
+        """
+        labels = self.y_train_encoded[neighbors_idx]
+        n_query, k = labels.shape
+        n_classes = len(self.classes)
+        rows = np.arange(n_query)
+
+        counts = np.bincount(
+            (rows[:, np.newaxis] * n_classes + labels).ravel(),
+            minlength=n_query * n_classes,
+        ).reshape(n_query, n_classes)
+
+        # Rank of the nearest neighbour of every class, k if it has none.
+        nearest_rank = np.full((n_query, n_classes), k)
+        for rank in range(k - 1, -1, -1):
+            nearest_rank[rows, labels[:, rank]] = rank
+
+        return np.argmax(counts * (k + 1) - nearest_rank, axis=1)
+
+    def _tile_sizes(
+        self,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+    ) -> tuple[int, int]:
+        """
+        Split the memory budget over the number of queries and training points
+        that are compared in one tile.
+
+        Args:
+            chunk_size (int, optional): Requested number of queries per tile.
+                When omitted, tiles span as much of the training set as the
+                budget allows.
+            max_memory_mb (float): Memory budget for one tile.
+
+        Returns:
+            tuple[int, int]: Number of queries and training points per tile.
+        """
+        n_train = self.n_train
+        max_distances = max(1, int(max_memory_mb * 2**20 / BYTES_PER_DISTANCE))
+
+        if chunk_size is not None:
+            if chunk_size < 1:
+                raise ValueError("Parameter 'chunk_size' must be at least 1.")
+            return chunk_size, max(1, min(n_train, max_distances // chunk_size))
+
+        train_chunk_size = min(n_train, max_distances)
+        return max(1, max_distances // train_chunk_size), train_chunk_size
+
+    def fit(
+        self,
+        X: Union[list[float], np.ndarray, ArraySource, ChunkSource],
+        y: list[float],
+    ) -> None:
+        """
+        Get training data, and build the index if one is used.
+
+        Sparse training points can be passed as any CSR matrix, such as a
+        scipy.sparse csr_matrix, see `sparse_matrix`. They are never densified:
+        the euclidean and cosine distances are computed from sparse dot
+        products with brute force, and queries are converted to CSR as well.
+
+        Training sets that do not fit in memory can be passed as a np.memmap,
+        an ArraySource or a ChunkSource, see `training_source`. They are never
+        loaded as a whole: every prediction streams the points chunk by chunk
+        with brute force (or the numba kernel per chunk), which is exact and
+        keeps memory bounded by `max_memory_mb`. Indices, partial_fit, save,
+        select_k, measure_recall and radius queries need the points in memory.
+
+        Args:
+            X: Training points of shape (n, d), a sparse CSR matrix, or an
+                out-of-core source.
+            y (list[float]): Labels of shape (n,).
+        """
+        self._neighbor_cache = None
+
+        if isinstance(X, np.memmap):
+            X = ArraySource(X)
+        if isinstance(X, (ArraySource, ChunkSource)):
+            self._fit_source(X, y)
+            return
+        if is_sparse(X):
+            self._fit_sparse(as_csr(X), y)
+            return
+
+        self.training_source = None
+        X = np.asarray(X, dtype=float)
+        if X.ndim != 2 or len(X) == 0:
+            raise ValueError(
+                "Expected at least one training point of shape (n, d), but "
+                f"got an array of shape {X.shape}."
+            )
+        if len(X) != len(y):
+            raise ValueError(f"Got {len(X)} points, but {len(y)} labels.")
+
+        # The cosine distance changes when the points are shifted.
+        if self.distance_metric != "cosine":
+            self.offset = self._mean = X.mean(axis=0)
+        else:
+            self.offset = self._mean = None
+
+        self.X_train = np.ascontiguousarray(self._shift(X))
+        self.n_train = len(self.X_train)
+        self.n_dimensions = X.shape[1]
+        if self.offset is not None:
+            self._offset_sum_squares = float(
+                np.sum(squared_norms(self.X_train), dtype=float)
+            )
+        self.classes, self.y_train_encoded = np.unique(
+            np.asarray(y), return_inverse=True
+        )
+
+        if self.distance_function in NORM_METRICS:
+            self.X_train_squared_norms = squared_norms(self.X_train)
+        else:
+            self.X_train_squared_norms = None
+
+        # The buffers are full, so the first append copies them instead of
+        # writing into the caller's array.
+        self._X_buffer = self.X_train
+        self._y_buffer = self.y_train_encoded
+        self._norms_buffer = self.X_train_squared_norms
+
+        n_samples, n_dimensions = self.X_train.shape
+        self.fitted_algorithm = self._choose_algorithm(n_samples, n_dimensions)
+        self._build_index()
+
+    def _fit_source(
+        self,
+        source: Union[ArraySource, ChunkSource],
+        y: list[float],
+    ) -> None:
+        """Fit on an out-of-core training source, only the labels are read."""
+        if self.dtype != "float64":
+            raise ValueError(
+                "An out-of-core training source only supports dtype='float64'."
+            )
+        if self.algorithm not in ["auto", "brute", "numba"]:
+            raise ValueError(
+                "An out-of-core training source only supports the 'brute' "
+                "and 'numba' algorithms."
+            )
+
+        self.classes, self.y_train_encoded = np.unique(
+            np.asarray(y), return_inverse=True
+        )
+        self.n_train = len(self.y_train_encoded)
+        if isinstance(source, ArraySource) and len(source) != self.n_train:
+            raise ValueError(
+                f"Got {len(source)} points, but {self.n_train} labels."
+            )
+
+        self.training_source = source
+        self.n_dimensions = (
+            source.n_dimensions if isinstance(source, ArraySource) else None
+        )
+        self.fitted_algorithm = (
+            "numba" if self.algorithm == "numba" else "brute"
+        )
+        self.X_train = None
+        self.X_train_squared_norms = None
+        self.index = None
+        self.n_indexed = 0
+        self._X_buffer = None
+        self._y_buffer = self.y_train_encoded
+        self._norms_buffer = None
+
+    def _fit_sparse(
+        self,
+        X: CSRMatrix,
+        y: list[float],
+    ) -> None:
+        """Fit on sparse training points, which are scanned with brute force."""
+        if self.algorithm not in ["auto", "brute"]:
+            raise ValueError("Sparse inputs only support algorithm='brute'.")
+        if self.dtype != "float64":
+            raise ValueError("Sparse inputs only support dtype='float64'.")
+        if self.distance_metric not in SPARSE_METRICS:
+            raise ValueError(
+                f"Sparse inputs only support the metrics {SPARSE_METRICS}."
+            )
+        if len(X) != len(y):
+            raise ValueError(f"Got {len(X)} points, but {len(y)} labels.")
+
+        self.training_source = None
+        self.X_train = X
+        self.n_train = len(X)
+        self.n_dimensions = X.shape[1]
+        self.classes, self.y_train_encoded = np.unique(
+            np.asarray(y), return_inverse=True
+        )
+        self.X_train_squared_norms = X.squared_norms()
+        # Build the column-major copy now, instead of in the first predict.
+        X.columns()
+
+        self.fitted_algorithm = "brute"
+        self.index = None
+        self.n_indexed = 0
+        self._X_buffer = None
+        self._y_buffer = self.y_train_encoded
+        self._norms_buffer = None
+
+    def _as_queries(
+        self,
+        X: Union[list[float], np.ndarray, CSRMatrix],
+    ) -> Union[np.ndarray, CSRMatrix]:
+        """Convert query points to the format of the training points."""
+        if isinstance(self.X_train, CSRMatrix):
+            return as_csr(X) if is_sparse(X) else CSRMatrix.from_dense(X)
+        if is_sparse(X):
+            raise ValueError(
+                "Sparse query points require sparse training points."
+            )
+        return self._shift(X)
+
+    def _shift(
+        self,
+        X: Union[list[float], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Convert dense points to the dtype of the training points, after
+        subtracting the offset in float64.
+
+        float32 keeps about 7 significant digits and float64 about 16. Points
+        that are far from the origin compared to the distances between them,
+        such as UTM or ECEF coordinates, would lose most of them in the
+        conversion, and the euclidean kernel ||a||^2 - 2 a.b + ||b||^2 would
+        cancel catastrophically, in float64 as well. All metrics except
+        cosine are unchanged by the shift, so the training points are stored
+        centred on their mean.
+        """
+        if self.offset is None:
+            return np.asarray(X, dtype=DTYPES[self.dtype])
+        return _shifted(X, self.offset, DTYPES[self.dtype])
+
+    def _update_offset(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Add a batch of shifted points that was just appended to the running
+        mean, and move the offset to the mean once it has drifted by more
+        than RECENTER_DRIFT times the spread of the training points. Moving it
+        costs one pass over the points, so it only happens after the training
+        set has changed considerably.
+        """
+        n_old = self.n_train - len(X)
+        drift = (
+            n_old * (self._mean - self.offset) + X.sum(axis=0, dtype=float)
+        ) / self.n_train
+        self._mean = self.offset + drift
+        self._offset_sum_squares += float(np.sum(squared_norms(X), dtype=float))
+
+        drift_squared = float(drift @ drift)
+        variance = self._offset_sum_squares / self.n_train - drift_squared
+        if drift_squared <= RECENTER_DRIFT**2 * variance:
+            return
+
+        self.offset = self._mean
+        self._offset_sum_squares = self.n_train * variance
+        self.X_train = _shifted(self.X_train, drift, DTYPES[self.dtype])
+        self._X_buffer = self.X_train
+        if self._norms_buffer is not None:
+            self.X_train_squared_norms = squared_norms(self.X_train)
+            self._norms_buffer = self.X_train_squared_norms
+        if self.index is not None:
+            self._build_index()
+
+    def _check_dense(
+        self,
+        action: str,
+    ) -> None:
+        """Raise for actions that do not support sparse training points."""
+        if isinstance(self.X_train, CSRMatrix):
+            raise ValueError(
+                f"{action} is not supported with sparse training points."
+            )
+
+    def _check_in_memory(
+        self,
+        action: str,
+    ) -> None:
+        """Raise for actions that need the training points in memory."""
+        if self.training_source is not None:
+            raise ValueError(
+                f"{action} is not supported with an out-of-core training "
+                "source."
+            )
+
+    def _scan_training_source(
+        self,
+        X: np.ndarray,
+        k: int,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+    ) -> np.ndarray:
+        """
+        Find the k nearest neighbours of all queries in one sequential pass
+        over the out-of-core training source.
+
+        Every training chunk is compared with the whole query batch, tile by
+        tile, and merged into a running top-k per query. The next chunks are
+        read in a background thread in the meantime.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours.
+            chunk_size (int, optional): Number of queries per tile.
+            max_memory_mb (float): Memory budget, shared by the chunks that
+                are read ahead and the tile of distances.
+
+        Returns:
+            np.ndarray: Indices of shape (n_query, k), ordered from nearest to
+                furthest.
+        """
+        k = min(k, self.n_train)
+        max_distances = max(1, int(max_memory_mb * 2**20 / BYTES_PER_DISTANCE))
+
+        train_chunk_size = min(self.n_train, max_distances)
+        if isinstance(self.training_source, ArraySource):
+            # The chunks that are read ahead must fit in the budget as well.
+            bytes_per_point = 8 * self.training_source.n_dimensions
+            train_chunk_size = max(
+                1,
+                min(
+                    train_chunk_size,
+                    int(
+                        max_memory_mb
+                        * 2**20
+                        / (bytes_per_point * (PREFETCH_DEPTH + 2))
+                    ),
+                ),
+            )
+
+        best_distances = np.full((len(X), k), np.inf)
+        best_idx = np.full((len(X), k), -1)
+        start = 0
+
+        if self.fitted_algorithm == "numba":
+            from numba_kernels import fused_k_nearest, metric_code
+
+        for chunk in prefetch(self.training_source.chunks(train_chunk_size)):
+            # A ChunkSource can yield empty chunks, for example empty files.
+            if len(chunk) == 0:
+                continue
+            self.n_dimensions = chunk.shape[1]
+            query_chunk_size = chunk_size or max(1, max_distances // len(chunk))
+
+            for query_start in range(0, len(X), query_chunk_size):
+                rows = slice(query_start, query_start + query_chunk_size)
+
+                if self.fitted_algorithm == "numba":
+                    distances, idx = fused_k_nearest(
+                        np.ascontiguousarray(X[rows]),
+                        chunk,
+                        min(k, len(chunk)),
+                        metric_code(self.distance_metric, self.p),
+                        float(self.p),
+                    )
+                    idx += start
+                else:
+                    distances = self.distance_function(X[rows], chunk)
+                    idx = np.arange(start, start + len(chunk))
+
+                best_distances[rows], best_idx[rows] = merge_top_k(
+                    best_distances[rows], best_idx[rows], distances, idx, k
+                )
+
+            start += len(chunk)
+
+        if start != self.n_train:
+            raise ValueError(
+                f"The training source produced {start} points, but it was "
+                f"fitted with {self.n_train} labels."
+            )
+
+        return best_idx
+
+    def _build_index(self) -> None:
+        """Build the index of the fitted algorithm over all training points."""
+        self.n_indexed = self.n_train
+
+        if self.fitted_algorithm == "kd_tree":
+            if self.distance_function is not euclidean_distances:
+                raise ValueError(
+                    "The KD-tree only supports the euclidean metric, use "
+                    "algorithm='ball_tree' for other metrics."
+                )
+            self.index = KDTree(self.X_train, leaf_size=self.leaf_size)
+        elif self.fitted_algorithm in ["ball_tree", "grid"] and (
+            self.distance_function is cosine_distances
+        ):
+            raise ValueError(
+                "The cosine distance does not satisfy the triangle "
+                "inequality, which the ball tree and the grid rely on."
+            )
+        elif self.fitted_algorithm == "ball_tree":
+            self.index = BallTree(
+                self.X_train,
+                distance_function=self.distance_function,
+                leaf_size=self.leaf_size,
+            )
+        elif self.fitted_algorithm == "grid":
+            self.index = GridIndex(
+                self.X_train,
+                distance_function=self.distance_function,
+                **self.index_params,
+            )
+        elif self.fitted_algorithm == "hnsw":
+            HNSWIndex = _index_class("hnsw")
+            self.index = HNSWIndex(
+                self.X_train,
+                distance_metric=self.distance_metric,
+                p=self.p,
+                **self.index_params,
+            )
+            # Share the points with the graph instead of keeping a copy.
+            self.X_train = self.index.X
+        elif self.fitted_algorithm == "lsh":
+            self.index = LSHIndex(
+                self.X_train,
+                distance_function=self.distance_function,
+                **self.index_params,
+            )
+            self.X_train = self.index.X
+        elif self.fitted_algorithm == "pq":
+            if self.distance_function is not euclidean_distances:
+                raise ValueError(
+                    "Product quantization only supports the euclidean metric."
+                )
+            self.index = ProductQuantizationIndex(
+                self.X_train, **self.index_params
+            )
+            # Only the codes are kept, unless the index re-ranks candidates
+            # with the original points.
+            self.X_train = self.index.X
+            self.X_train_squared_norms = None
+            self._norms_buffer = None
+        elif self.fitted_algorithm == "int8":
+            if self.distance_function is not euclidean_distances:
+                raise ValueError(
+                    "dtype='int8' only supports the euclidean metric."
+                )
+            self.index = ScalarQuantizationIndex(
+                self.X_train, **self.index_params
+            )
+            # The float32 points are kept once, by the index.
+            self.X_train = self.index.X
+        else:
+            if self.fitted_algorithm == "numba":
+                from numba_kernels import metric_code
+
+                # Raises for metrics without a compiled kernel.
+                metric_code(self.distance_metric, self.p)
+            self.index = None
+            self.n_indexed = 0
+
+    def _encode_labels(
+        self,
+        y: np.ndarray,
+    ) -> np.ndarray:
+        """Encode labels as indices into classes, adding unseen classes."""
+        labels, inverse = np.unique(np.asarray(y), return_inverse=True)
+        unseen = ~np.isin(labels, self.classes)
+        self.classes = np.concatenate((self.classes, labels[unseen]))
+
+        order = np.argsort(self.classes, kind="stable")
+        codes = order[np.searchsorted(self.classes, labels, sorter=order)]
+        return codes[inverse]
+
+    def partial_fit(
+        self,
+        X: list[float],
+        y: list[float],
+    ) -> None:
+        """
+        Add training data without refitting on everything seen so far.
+
+        The points are appended to buffers that grow geometrically, so adding
+        a batch takes amortized time proportional to the batch. The "lsh",
+        "hnsw" and "pq" indices insert the new points themselves. A tree or
+        grid cannot be updated in place, so new points are scanned directly
+        next to it until they outnumber the points in it, and only then is it
+        rebuilt. Classes that were not seen before are appended to `classes`.
+        On an unfitted classifier this is the same as `fit`.
+
+        Args:
+            X (list[float]): New points of shape (n, d).
+            y (list[float]): Their labels, of shape (n,).
+        """
+        self._check_in_memory("Adding training data")
+        self._check_dense("Adding training data")
+        if self.classes is None:
+            self.fit(X, y)
+            return
+
+        self._neighbor_cache = None
+        X = self._shift(X)
+        if len(X) != len(y):
+            raise ValueError(f"Got {len(X)} points, but {len(y)} labels.")
+
+        start = self.n_train
+        self.n_train += len(X)
+        self._y_buffer = append(self._y_buffer, start, self._encode_labels(y))
+        self.y_train_encoded = self._y_buffer[: self.n_train]
+
+        if self._norms_buffer is not None:
+            self._norms_buffer = append(
+                self._norms_buffer, start, squared_norms(X)
+            )
+            self.X_train_squared_norms = self._norms_buffer[: self.n_train]
+
+        if self.fitted_algorithm in INCREMENTAL_ALGORITHMS:
+            self.index.add(X)
+            self.n_indexed = self.n_train
+            self.X_train = self.index.X
+        else:
+            self._X_buffer = append(self._X_buffer, start, X)
+            self.X_train = self._X_buffer[: self.n_train]
+
+            if self.index is not None and self.n_train > 2 * self.n_indexed:
+                self._build_index()
+
+        if self.offset is not None:
+            self._update_offset(X)
+
+    def save(
+        self,
+        path: Union[str, Path],
+    ) -> None:
+        """
+        Save the fitted classifier as a directory of raw arrays, which `load`
+        can memory-map. See `persistence` for the format.
+
+        The training points are written once, also when the index shares them.
+        Classes must be numbers or strings, object arrays cannot be mapped.
+
+        Args:
+            path (str | Path): Directory, created if it does not exist.
+        """
+        self._check_in_memory("Saving")
+        self._check_dense("Saving")
+        if self.classes is None:
+            raise ValueError("Cannot save a classifier that is not fitted.")
+
+        arrays = {
+            "classes": self.classes,
+            "y_train_encoded": self.y_train_encoded,
+        }
+        if self.X_train_squared_norms is not None:
+            arrays["X_train_squared_norms"] = self.X_train_squared_norms
+        if self.fitted_algorithm not in INCREMENTAL_ALGORITHMS:
+            arrays["X_train"] = self.X_train
+        if self.offset is not None:
+            arrays["offset"] = self.offset
+            arrays["mean"] = self._mean
+
+        index_parameters = None
+        if self.index is not None:
+            index_arrays, index_parameters = self.index.state()
+            # A tree or grid holds the first n_indexed training points.
+            index_arrays.pop("X", None)
+            for name, array in index_arrays.items():
+                arrays[f"index.{name}"] = array
+
+        parameters = {
+            "class": type(self).__name__,
+            "init": self._init_parameters(),
+            "fitted_algorithm": self.fitted_algorithm,
+            "n_train": self.n_train,
+            "n_indexed": self.n_indexed,
+            "n_dimensions": self.n_dimensions,
+            "offset_sum_squares": self._offset_sum_squares,
+            "index": index_parameters,
+        }
+        save_arrays(path, arrays, parameters)
+
+    def _init_parameters(self) -> dict:
+        """Arguments of __init__ that recreate this classifier, for `load`."""
+        return {
+            "k": self.k,
+            "distance_metric": self.distance_metric,
+            "algorithm": self.algorithm,
+            "leaf_size": self.leaf_size,
+            "p": self.p,
+            "n_jobs": self.n_jobs,
+            "index_params": self.index_params,
+            "cache_k": self.cache_k,
+            "dtype": self.dtype,
+        }
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        mmap: bool = True,
+    ) -> "KNNClassifier":
+        """
+        Load a classifier that was written with `save`.
+
+        The class that was saved is recreated, so KNNClassifier.load also
+        loads a saved RadiusNeighborsClassifier. Loading through a subclass
+        requires a model of that subclass.
+
+        Args:
+            path (str | Path): Directory that was written with `save`.
+            mmap (bool): Memory-map the arrays read-only instead of reading
+                them, so processes that load the same model share its memory.
+                The classifier can still be extended with `partial_fit`, which
+                copies the arrays it appends to.
+
+        Returns:
+            KNNClassifier: The fitted classifier.
+        """
+        arrays, parameters = load_arrays(path, mmap)
+
+        # Models saved before the class was recorded are loaded as cls.
+        classifier_class = _classifier_class(
+            parameters.get("class", cls.__name__)
+        )
+        if not issubclass(classifier_class, cls):
+            raise ValueError(
+                f"The model is a {classifier_class.__name__}, it cannot be "
+                f"loaded as a {cls.__name__}."
+            )
+
+        classifier = classifier_class(**parameters["init"])
+        classifier.fitted_algorithm = parameters["fitted_algorithm"]
+        classifier.n_train = parameters["n_train"]
+        classifier.n_indexed = parameters["n_indexed"]
+        classifier.classes = arrays["classes"]
+        classifier.y_train_encoded = arrays["y_train_encoded"]
+        classifier.X_train_squared_norms = arrays.get("X_train_squared_norms")
+        classifier.X_train = arrays.get("X_train")
+        classifier.n_dimensions = parameters.get("n_dimensions")
+        classifier.offset = arrays.get("offset")
+        classifier._mean = arrays.get("mean")
+        classifier._offset_sum_squares = parameters.get(
+            "offset_sum_squares", 0.0
+        )
+
+        index_class = _index_class(classifier.fitted_algorithm)
+        if index_class is not None:
+            index_arrays = {
+                name[len("index.") :]: array
+                for name, array in arrays.items()
+                if name.startswith("index.")
+            }
+            extra_arguments = {}
+            if classifier.fitted_algorithm in ["kd_tree", "ball_tree", "grid"]:
+                index_arrays["X"] = classifier.X_train[: classifier.n_indexed]
+            if classifier.fitted_algorithm in ["ball_tree", "grid", "lsh"]:
+                extra_arguments["distance_function"] = (
+                    classifier.distance_function
+                )
+
+            classifier.index = index_class.from_state(
+                index_arrays, parameters["index"], **extra_arguments
+            )
+            if classifier.fitted_algorithm in INCREMENTAL_ALGORITHMS:
+                classifier.X_train = classifier.index.X
+
+        if classifier.n_dimensions is None and classifier.X_train is not None:
+            # Saved before the number of dimensions was recorded.
+            classifier.n_dimensions = classifier.X_train.shape[1]
+
+        classifier._X_buffer = classifier.X_train
+        classifier._y_buffer = classifier.y_train_encoded
+        classifier._norms_buffer = classifier.X_train_squared_norms
+
+        return classifier
+
+    def select_k(
+        self,
+        k_range: Iterable[int],
+        cv: str = "loo",
+    ) -> tuple[int, dict[int, float]]:
+        """
+        Choose k by cross-validation on the training data.
+
+        With leave-one-out, every training point is classified by the other
+        training points. The k_max + 1 nearest neighbours of all training
+        points are found in one pass, the point itself is removed from its own
+        list, and every k in the range is scored by voting over the first k
+        remaining neighbours. This costs one neighbour search instead of one
+        per value of k.
+
+        Args:
+            k_range (Iterable[int]): Candidate values of k, for example
+                range(1, 11). At most the number of training points minus 1.
+            cv (str): Cross-validation method. Only "loo" (leave-one-out).
+
+        Returns:
+            tuple[int, dict[int, float]]: The k with the highest accuracy,
+                the smallest one on a tie, and the accuracy of every k.
+        """
+        self._check_in_memory("Selecting k")
+        if cv not in CV_METHODS:
+            raise ValueError(f"Unknown cv '{cv}'. Options are {CV_METHODS}.")
+        if self.X_train is None:
+            raise ValueError("Selecting k requires the fitted training points.")
+
+        k_values = sorted(set(k_range))
+        k_max = k_values[-1]
+        if k_values[0] < 1 or k_max >= self.n_train:
+            raise ValueError(
+                f"Every k must be between 1 and {self.n_train - 1}."
+            )
+
+        neighbors_idx = np.concatenate(
+            self._neighbor_chunks(self.X_train, k_max + 1, None, MAX_MEMORY_MB)
+        )
+
+        # Remove every point from its own neighbours. A point can be missing
+        # from its list when it has many exact duplicates or the algorithm is
+        # approximate, in that case the furthest neighbour is removed instead.
+        is_self = neighbors_idx == np.arange(self.n_train)[:, np.newaxis]
+        is_self[~is_self.any(axis=1), -1] = True
+        neighbors_idx = neighbors_idx[~is_self].reshape(self.n_train, k_max)
+
+        scores = {
+            k: float(
+                np.mean(
+                    self._vote(neighbors_idx[:, :k]) == self.y_train_encoded
+                )
+            )
+            for k in k_values
+        }
+        best_k = max(k_values, key=lambda k: (scores[k], -k))
+
+        return best_k, scores
+
+    def measure_recall(
+        self,
+        X: np.ndarray,
+    ) -> float:
+        """
+        Measure how many of the true k nearest neighbours the fitted algorithm
+        finds, by comparing it with an exact brute force search.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d), for example a
+                held out sample of the data that will be predicted.
+
+        Returns:
+            float: Fraction of the exact neighbours that were found, between 0
+                and 1. Always 1 for the exact algorithms.
+        """
+        self._check_in_memory("Measuring recall")
+        if self.X_train is None:
+            raise ValueError(
+                "Measuring recall requires the original training points, fit "
+                "with index_params={'rerank': ...} to keep them."
+            )
+
+        X = self._as_queries(X)
+        neighbors_idx = np.concatenate(
+            self._neighbor_chunks(X, self.k, None, MAX_MEMORY_MB)
+        )
+
+        # The exact search is tiled like any other, so it stays within the
+        # memory budget for large query sets.
+        exact_idx = np.concatenate(
+            self._neighbor_chunks(X, self.k, None, MAX_MEMORY_MB, exact=True)
+        )
+
+        found = [
+            len(np.intersect1d(approximate, exact))
+            for approximate, exact in zip(neighbors_idx, exact_idx)
+        ]
+        return sum(found) / exact_idx.size
+
+    def _radius_neighbors_tile(
+        self,
+        X: np.ndarray,
+        r: float,
+        train_chunk_size: int,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Radius neighbours of one tile of queries, see `radius_neighbors`."""
+        # Start with empty arrays, so that the concatenation never fails.
+        rows = [np.empty(0, dtype=int)]
+        indices = [np.empty(0, dtype=int)]
+        distances = [np.empty(0)]
+        start = 0
+
+        if self.fitted_algorithm in RADIUS_ALGORITHMS:
+            offsets, index_idx, index_distances = self.index.query_radius(X, r)
+            rows.append(np.repeat(np.arange(len(X)), np.diff(offsets)))
+            indices.append(index_idx)
+            distances.append(index_distances)
+            start = self.n_indexed
+
+        # Points without an index, or added after it was built.
+        for chunk_start in range(start, self.n_train, train_chunk_size):
+            chunk_stop = min(chunk_start + train_chunk_size, self.n_train)
+            chunk_distances = self._compute_distance(
+                X, self.X_train[chunk_start:chunk_stop]
+            )
+            chunk_rows, cols = np.nonzero(chunk_distances <= r)
+            rows.append(chunk_rows)
+            indices.append(chunk_start + cols)
+            distances.append(chunk_distances[chunk_rows, cols])
+
+        return group_by_row(
+            np.concatenate(rows),
+            np.concatenate(indices),
+            np.concatenate(distances),
+            len(X),
+        )
+
+    def radius_neighbors(
+        self,
+        X: np.ndarray,
+        r: float,
+        chunk_size: Optional[int] = None,
+        max_memory_mb: float = MAX_MEMORY_MB,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all training points within distance r of every query point.
+
+        The result is stored CSR-style, as flat arrays instead of a list per
+        query: the neighbours of query i are
+        indices[offsets[i] : offsets[i + 1]], sorted on distance and then on
+        index. The trees and the grid answer the query with their index, the
+        other algorithms scan the training points in tiles of `max_memory_mb`.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            r (float): Radius, points at exactly distance r are included.
+            chunk_size (int, optional): Number of queries per tile.
+            max_memory_mb (float): Memory budget for one tile of distances.
+                The result itself is not part of this budget.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Offsets of shape
+                (n_query + 1,), and the indices into X_train and distances of
+                the neighbours of all queries concatenated.
+        """
+        self._check_in_memory("Radius queries")
+        if self.X_train is None:
+            raise ValueError(
+                "Radius queries require the original training points, fit "
+                "with index_params={'rerank': ...} to keep them."
+            )
+        if r < 0:
+            raise ValueError("Parameter 'r' must be at least 0.")
+
+        X = self._as_queries(X)
+        query_chunk_size, train_chunk_size = self._tile_sizes(
+            chunk_size, max_memory_mb
+        )
+
+        offsets = [np.zeros(1, dtype=int)]
+        indices, distances = [np.empty(0, dtype=int)], [np.empty(0)]
+
+        for start in range(0, len(X), query_chunk_size):
+            tile_offsets, tile_indices, tile_distances = (
+                self._radius_neighbors_tile(
+                    X[start : start + query_chunk_size], r, train_chunk_size
+                )
+            )
+            offsets.append(offsets[-1][-1] + tile_offsets[1:])
+            indices.append(tile_indices)
+            distances.append(tile_distances)
+
+        return (
+            np.concatenate(offsets),
+            np.concatenate(indices),
+            np.concatenate(distances),
+        )
+
+    def _neighbor_chunks(
+        self,
+        X: np.ndarray,
+        k: int,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+        exact: bool = False,
+    ) -> list[np.ndarray]:
+        """
+        Find the k nearest neighbours of every query, tile by tile. With
+        `exact`, by brute force, see `_get_neighbors`.
+        """
+        n_workers = self._n_workers()
+
+        if self.fitted_algorithm in ["numba", "hnsw"] and not exact:
+            import numba
+
+            # The compiled kernels parallelize over queries themselves.
+            numba.set_num_threads(
+                min(n_workers, numba.config.NUMBA_NUM_THREADS)
+            )
+            n_workers = 1
+
+        if self.training_source is not None:
+            return [self._scan_training_source(X, k, chunk_size, max_memory_mb)]
+
+        # Every worker holds one tile, so they share the memory budget.
+        query_chunk_size, train_chunk_size = self._tile_sizes(
+            chunk_size, max_memory_mb / n_workers
+        )
+        query_chunks = [
+            X[start : start + query_chunk_size]
+            for start in range(0, len(X), query_chunk_size)
+        ]
+
+        def get_neighbors(query_chunk: np.ndarray) -> np.ndarray:
+            return self._get_neighbors(query_chunk, train_chunk_size, k, exact)
+
+        if n_workers == 1 or len(query_chunks) == 1:
+            return list(map(get_neighbors, query_chunks))
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(get_neighbors, query_chunks))
+
+    def _cached_neighbors(
+        self,
+        X: np.ndarray,
+        k: int,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+    ) -> np.ndarray:
+        """
+        Neighbours of the queries, from the cache when they were found before
+        for at least k neighbours. Otherwise max(k, cache_k) neighbours are
+        found and cached. Comparing the queries with the cached ones costs
+        O(n_query * d), which is negligible next to the search.
+        """
+        if self._neighbor_cache is not None:
+            cached_X, cached_neighbors = self._neighbor_cache
+            enough = cached_neighbors.shape[1] >= min(k, self.n_train)
+            if isinstance(X, CSRMatrix):
+                same = isinstance(cached_X, CSRMatrix) and X.equals(cached_X)
+            else:
+                same = np.array_equal(cached_X, X)
+            if enough and same:
+                return cached_neighbors
+
+        k = max(k, self.cache_k)
+        neighbor_chunks = self._neighbor_chunks(X, k, chunk_size, max_memory_mb)
+        if neighbor_chunks:
+            neighbors_idx = np.concatenate(neighbor_chunks)
+        else:
+            neighbors_idx = np.empty((0, min(k, self.n_train)), dtype=int)
+
+        self._neighbor_cache = (X.copy(), neighbors_idx)
+        return neighbors_idx
+
+    def _predict_batch(
+        self,
+        X: np.ndarray,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+        k: Optional[int] = None,
+    ) -> np.ndarray:
+        """Predict one array of query points."""
+        X = self._as_queries(X)
+        k = self.k if k is None else k
+
+        if self.cache_k > 0:
+            # Neighbours are sorted, so the k nearest are the first k columns.
+            neighbors_idx = self._cached_neighbors(
+                X, k, chunk_size, max_memory_mb
+            )
+            neighbor_chunks = [neighbors_idx[:, :k]]
+        else:
+            neighbor_chunks = self._neighbor_chunks(
+                X, k, chunk_size, max_memory_mb
+            )
+
+        results = [
+            self._vote(neighbors_idx) for neighbors_idx in neighbor_chunks
+        ]
+
+        if not results:
+            return self.classes[:0]
+
+        return self.classes[np.concatenate(results)]
+
+    def enable_stats(self) -> None:
+        """
+        Start recording the wall time of the phases of predict and the number
+        of distances evaluated, see `stats`.
+
+        The phases are timed by wrappers that shadow `_predict_batch`,
+        `_get_neighbors`, `_scan_training_source`, `_compute_distance` and
+        `_vote` on this instance. Until this is called, and after
+        `disable_stats`, predict runs the methods of the class, so the
+        statistics cost nothing when they are disabled.
+        """
+        if self._stats is not None:
+            return
+
+        stats = PredictStats()
+        get_neighbors = self._get_neighbors
+
+        def instrumented_get_neighbors(
+            X: np.ndarray,
+            *args: object,
+        ) -> np.ndarray:
+            start = time.perf_counter()
+            counts = {}
+
+            if self.index is not None and stats.count_distances(self.index):
+                neighbors_idx = stats.track_index(
+                    lambda: get_neighbors(X, *args),
+                    len(X) * self.n_indexed,
+                )
+            else:
+                neighbors_idx = get_neighbors(X, *args)
+                if self.fitted_algorithm == "numba":
+                    # The fused kernel compares every query with every point.
+                    counts["distances_evaluated"] = len(X) * self.n_train
+
+            stats.add("neighbors", time.perf_counter() - start, **counts)
+            return neighbors_idx
+
+        self._predict_batch = stats.timed(
+            "predict",
+            self._predict_batch,
+            lambda args, result: {"n_queries": len(result)},
+        )
+        self._get_neighbors = instrumented_get_neighbors
+        self._scan_training_source = stats.timed(
+            "neighbors",
+            self._scan_training_source,
+            lambda args, result: {
+                "distances_evaluated": len(args[0]) * self.n_train
+            },
+        )
+        self._compute_distance = stats.timed(
+            "distance",
+            self._compute_distance,
+            lambda args, result: {"distances_evaluated": result.size},
+        )
+        self._vote = stats.timed("vote", self._vote)
+        self._stats = stats
+
+    def disable_stats(self) -> None:
+        """Stop recording statistics and discard them, see `enable_stats`."""
+        if self._stats is None:
+            return
+
+        for name in [
+            "_predict_batch",
+            "_get_neighbors",
+            "_scan_training_source",
+            "_compute_distance",
+            "_vote",
+        ]:
+            del self.__dict__[name]
+        PredictStats.uncount_distances(self.index)
+        self._stats = None
+
+    def reset_stats(self) -> None:
+        """Set the recorded statistics to zero."""
+        self.stats()
+        self._stats.reset()
+
+    def stats(self) -> dict:
+        """
+        Statistics of the predict calls since `enable_stats` or `reset_stats`.
+
+        Times are cumulative wall clock seconds per phase: "predict" for whole
+        batches, "neighbors" for the nearest neighbour search, which contains
+        "distance" (the distance blocks of brute force and the distances that
+        kd_tree, ball_tree, grid and lsh compute), and "vote". Tiles that run
+        on several threads add up, so the sum can exceed the elapsed time.
+
+        Returns:
+            dict: See `PredictStats.as_dict`. The distances evaluated by
+                "numba" and by the out-of-core scan are counted as the number
+                of query and training point pairs, those of the compiled
+                "hnsw" search and of the quantized "pq" and "int8" scans are
+                not counted.
+        """
+        if self._stats is None:
+            raise ValueError(
+                "Statistics are not recorded, call 'enable_stats' first."
+            )
+        return self._stats.as_dict()
+
+    def _n_workers(self) -> int:
+        """Resolve n_jobs to a number of threads."""
+        if self.n_jobs == -1:
+            return os.cpu_count() or 1
+        if self.n_jobs < 1:
+            raise ValueError("Parameter 'n_jobs' must be -1 or at least 1.")
+        return self.n_jobs
+
+    def _predict_stream(
+        self,
+        batches: Iterator,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+        k: Optional[int],
+    ) -> Iterator[np.ndarray]:
+        """Yield the predictions for every batch of an iterator of batches."""
+        for batch in batches:
+            yield self._predict_batch(batch, chunk_size, max_memory_mb, k)
+
+    def predict(
+        self,
+        X: Union[list[float], np.ndarray, Iterator],
+        chunk_size: Optional[int] = None,
+        max_memory_mb: float = MAX_MEMORY_MB,
+        k: Optional[int] = None,
+    ) -> Union[np.ndarray, Iterator[np.ndarray]]:
+        """
+        Predict the class of every query point.
+
+        The queries are compared with the training set in tiles that fit in
+        `max_memory_mb`, and only the k nearest neighbours found so far are
+        kept per query. Peak memory therefore does not depend on the number of
+        queries or training points.
+
+        Args:
+            X: Query points of shape (n_query, d), a sparse CSR matrix, or an
+                iterator (for example a generator) that yields such batches.
+            chunk_size (int, optional): Number of queries per tile. By default
+                it is derived from `max_memory_mb`.
+            max_memory_mb (float): Memory budget for one tile.
+            k (int, optional): Number of neighbours that vote, defaults to
+                the k of the classifier. See `cache_k` to switch between
+                values of k without searching again.
+
+        Returns:
+            The predicted classes of shape (n_query,). If X is an iterator, a
+            generator that lazily yields the predictions of every batch.
+        """
+        if isinstance(X, Iterator):
+            return self._predict_stream(X, chunk_size, max_memory_mb, k)
+
+        return self._predict_batch(X, chunk_size, max_memory_mb, k)
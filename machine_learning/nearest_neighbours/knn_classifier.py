@@ -58,83 +58,45 @@ def _():
     import marimo as mo
     import numpy as np
 
-    from collections import Counter
     from drawdata import ScatterWidget
-    return Counter, ScatterWidget, mo, np
+    from knn import KNNClassifier
+    return KNNClassifier, ScatterWidget, mo, np
 
 
 @app.cell(column=1)
-def _(Counter, np):
-    class KNNClassifier:
-        """Class for classification according to the KNN-algorithm."""
-        def __init__(
-            self,
-            k: int,
-            distance_metric: str = "euclidean"
-        ) -> None:
-            """Initialising the KNNClassifier class."""
-            self.k = k
-            self.distance_metric = distance_metric
-
-            self.X_train = None
-            self.y_train = None
-
-        def _compute_distance(
-            self,
-            x1: list[float],
-            x2: list[float]
-        ) -> float:
-            if self.distance_metric == "euclidean":
-                return np.sqrt(np.sum((x1 - x2) ** 2))
-            else:
-                raise NotImplementedError
-
-        def _get_neighbors(
-            self,
-            x
-        ) -> list[int]:
-            """"""
-            distances = [self._compute_distance(x, xt) for xt in self.X_train]
-            neighbors_idx = np.argsort(distances)[:self.k]
-
-            return neighbors_idx
-
-        def fit(
-            self,
-            X: list[float],
-            y: list[float],
-        ) -> None:
-            """Get training data."""
-            self.X_train = X
-            self.y_train = y
-
-        def predict(
-            self,
-            X: list[float]
-        ) -> np.array:
-            """Predict"""
-            results = []
-        
-            for x in X:
-                idx = self._get_neighbors(x)
-                labels = self.y_train[idx]
-                most_common_class = Counter(labels).most_common(1)
-                results.append(most_common_class[0][0])
-
-            return np.array(results)
-    return (KNNClassifier,)
-
+def _(KNNClassifier, X_train, mo, y_train):
+    mo.stop(
+        len(X_train) == 0,
+        mo.md("Draw training points to fit the classifier."),
+    )
 
-@app.cell
-def _(KNNClassifier, X_predict, X_train, y_train):
-    knn_classifier = KNNClassifier(k=3)
+    # This cell does not depend on the slider. Neighbours are cached for the
+    # largest k of the slider, so moving it only repeats the vote.
+    knn_classifier = KNNClassifier(k=3, cache_k=10)
 
     knn_classifier.fit(
         X=X_train,
         y=y_train
     )
+    return (knn_classifier,)
+
+
+@app.cell
+def _(knn_classifier, mo):
+    mo.stop(knn_classifier.n_train < 2)
 
-    knn_classifier.predict(X=X_predict)
+    # Leave-one-out accuracy of every k on the slider that leaves at least one
+    # other point, from one neighbour search.
+    best_k, k_scores = knn_classifier.select_k(
+        range(1, min(11, knn_classifier.n_train))
+    )
+    print(f"{best_k=}")
+    return
+
+
+@app.cell
+def _(X_predict, k, knn_classifier):
+    knn_classifier.predict(X=X_predict, k=k.value)
     return
 
 
@@ -0,0 +1,308 @@
+"""Locality-sensitive hashing index for approximate nearest neighbour search."""
+
+from typing import Callable, Optional
+
+import numpy as np
+
+from buffers import append
+
+# Default number of hash tables. More tables find more of the true neighbours,
+# at the cost of memory and more candidates to check per query.
+N_TABLES = 8
+
+# Average number of training points per bucket that is aimed for when the
+# number of hash bits is not given.
+POINTS_PER_BUCKET = 32
+
+# Added points are kept in an unsorted buffer until they outnumber this
+# fraction of the points in the sorted tables, and only then merged into
+# them. Merging costs O(n), so adding takes amortized O(1) per point.
+MERGE_FRACTION = 0.25
+
+
+class LSHIndex:
+    """
+    Random projection hashing of the training points into buckets.
+
+    Every hash bit is the side of a random hyperplane a point lies on. Each
+    hyperplane is placed at the median of the training points projected on its
+    normal, so every bit splits the data in half and the buckets stay balanced.
+    Points that are close together are rarely separated by a hyperplane, so
+    they tend to share a bucket. A query gathers the points of its own bucket
+    in every table, and only those candidates are compared exactly.
+
+    The buckets of a table are stored as the training indices sorted on their
+    hash key, so looking up a bucket is a binary search. New points can be
+    added later, they are hashed with the same hyperplanes. Their keys are
+    appended to a buffer that is merged into the sorted tables once it holds
+    MERGE_FRACTION of their points, and until then queries also look up the
+    buffer, sorted once per batch of additions.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        n_tables: int = N_TABLES,
+        n_bits: Optional[int] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Hash the training points.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            distance_function (Callable): Vectorized kernel that is used to
+                compare a query with its candidates exactly.
+            n_tables (int): Number of hash tables. Increases recall.
+            n_bits (int, optional): Number of hash bits per table, at most 62.
+                More bits give smaller buckets, so faster but less accurate
+                queries. Defaults to about POINTS_PER_BUCKET points per bucket.
+            seed (int, optional): Seed for the random hyperplanes.
+        """
+        self.data = np.asarray(X, dtype=float)
+        self.size = len(self.data)
+        self.distance_function = distance_function
+
+        if len(self.X) == 0:
+            raise ValueError("Cannot hash an empty dataset.")
+        if n_tables < 1:
+            raise ValueError("Parameter 'n_tables' must be at least 1.")
+        if n_bits is None:
+            n_bits = int(np.log2(max(len(self.X) / POINTS_PER_BUCKET, 1)))
+        if not 0 <= n_bits <= 62:
+            raise ValueError("Parameter 'n_bits' must be between 0 and 62.")
+
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        rng = np.random.default_rng(seed)
+
+        n_samples, n_dimensions = self.X.shape
+        self.normals = rng.normal(size=(n_tables, n_bits, n_dimensions))
+        self.offsets = np.empty((n_tables, n_bits))
+        self.sorted_keys = np.empty((n_tables, n_samples), dtype=np.int64)
+        self.sorted_idx = np.empty((n_tables, n_samples), dtype=np.int64)
+
+        for table in range(n_tables):
+            projections = self.X @ self.normals[table].T
+            self.offsets[table] = np.median(projections, axis=0)
+
+            keys = self._hash(self.X, table)
+            order = np.argsort(keys, kind="stable")
+            self.sorted_keys[table] = keys[order]
+            self.sorted_idx[table] = order
+
+        # Points n_sorted, ..., size - 1 are only in the buffer of keys.
+        self.n_sorted = self.size
+        self.pending_keys = np.empty((0, n_tables), dtype=np.int64)
+        self._pending_tables = None
+
+    @property
+    def X(self) -> np.ndarray:
+        """The hashed points, shape (size, d)."""
+        return self.data[: self.size]
+
+    def add(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Hash new points with the existing hyperplanes.
+
+        The existing points are not hashed again. The new keys are appended to
+        the buffer, which is merged into the sorted tables when it has grown
+        to MERGE_FRACTION of them.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d). They get the ids
+                size, ..., size + n - 1.
+        """
+        X = np.asarray(X, dtype=float)
+        if len(X) == 0:
+            return
+
+        keys = np.stack(
+            [self._hash(X, table) for table in range(self.n_tables)], axis=1
+        )
+        self.pending_keys = append(
+            self.pending_keys, self.size - self.n_sorted, keys
+        )
+        self.data = append(self.data, self.size, X)
+        self.size += len(X)
+        self._pending_tables = None
+
+        if self.size - self.n_sorted > MERGE_FRACTION * self.n_sorted:
+            self._merge()
+
+    def _sorted_pending(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The buffered points as tables like `sorted_keys` and `sorted_idx`, of
+        shape (n_tables, n_pending). Cached until the next `add`.
+        """
+        if self._pending_tables is None:
+            keys = self.pending_keys[: self.size - self.n_sorted].T
+            order = np.argsort(keys, axis=1, kind="stable")
+            self._pending_tables = (
+                np.take_along_axis(keys, order, axis=1),
+                self.n_sorted + order,
+            )
+        return self._pending_tables
+
+    def _merge(self) -> None:
+        """Merge the buffered points into the sorted tables."""
+        if self.n_sorted == self.size:
+            return
+
+        pending_keys, pending_idx = self._sorted_pending()
+        sorted_keys, sorted_idx = [], []
+        for table in range(self.n_tables):
+            # Inserting on the right keeps every bucket sorted on index.
+            positions = np.searchsorted(
+                self.sorted_keys[table], pending_keys[table], "right"
+            )
+            sorted_keys.append(
+                np.insert(
+                    self.sorted_keys[table], positions, pending_keys[table]
+                )
+            )
+            sorted_idx.append(
+                np.insert(self.sorted_idx[table], positions, pending_idx[table])
+            )
+
+        self.sorted_keys = np.stack(sorted_keys)
+        self.sorted_idx = np.stack(sorted_idx)
+        self.n_sorted = self.size
+        self._pending_tables = None
+
+    def _hash(
+        self,
+        X: np.ndarray,
+        table: int,
+    ) -> np.ndarray:
+        """Hash keys of shape (n,) for the rows of X in one table."""
+        bits = X @ self.normals[table].T > self.offsets[table]
+        return bits @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+
+    def _candidates(
+        self,
+        X: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gather the union of the buckets of every query over all tables.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: CSR-style offsets of shape
+                (n_query + 1,) and the sorted, unique candidate indices of
+                every query concatenated.
+        """
+        n_query, n_samples = len(X), len(self.X)
+        query_ids, candidate_ids = [], []
+
+        tables = [(self.sorted_keys, self.sorted_idx)]
+        if self.n_sorted < self.size:
+            tables.append(self._sorted_pending())
+
+        for table in range(self.n_tables):
+            keys = self._hash(X, table)
+
+            for sorted_keys, sorted_idx in tables:
+                starts = np.searchsorted(sorted_keys[table], keys, "left")
+                stops = np.searchsorted(sorted_keys[table], keys, "right")
+                lengths = stops - starts
+
+                # Expand the bucket ranges [start, stop) of all queries at
+                # once.
+                positions = np.arange(lengths.sum()) + np.repeat(
+                    starts - np.cumsum(lengths) + lengths, lengths
+                )
+                query_ids.append(np.repeat(np.arange(n_query), lengths))
+                candidate_ids.append(sorted_idx[table][positions])
+
+        pairs = np.unique(
+            np.concatenate(query_ids) * n_samples
+            + np.concatenate(candidate_ids)
+        )
+        query_ids, candidate_ids = np.divmod(pairs, n_samples)
+        offsets = np.searchsorted(query_ids, np.arange(n_query + 1))
+
+        return offsets, candidate_ids
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find approximately the k nearest neighbours of every query point.
+
+        A query whose buckets hold fewer than k points falls back to an exact
+        scan over the whole training set.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours, at most the number of points.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+                (n_query, k), ordered from nearest to furthest. Equal distances
+                are ordered by index.
+        """
+        if not 1 <= k <= len(self.X):
+            raise ValueError(
+                f"Expected 1 <= k <= {len(self.X)}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=float)
+        offsets, candidate_ids = self._candidates(X)
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=int)
+
+        for i, x in enumerate(X):
+            idx = candidate_ids[offsets[i] : offsets[i + 1]]
+            if len(idx) < k:
+                idx = np.arange(len(self.X))
+
+            # Candidates are sorted on index, so the stable sort on distance
+            # orders ties by index.
+            candidate_distances = self.distance_function(
+                x[np.newaxis, :], self.X[idx]
+            )[0]
+            order = np.argsort(candidate_distances, kind="stable")[:k]
+            distances[i] = candidate_distances[order]
+            indices[i] = idx[order]
+
+        return distances, indices
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """
+        Arrays and parameters from which `from_state` rebuilds the index.
+        The buffered points are merged into the sorted tables first.
+        """
+        self._merge()
+        arrays = {
+            "data": self.X,
+            "normals": self.normals,
+            "offsets": self.offsets,
+            "sorted_keys": self.sorted_keys,
+            "sorted_idx": self.sorted_idx,
+        }
+        return arrays, {"n_tables": self.n_tables, "n_bits": self.n_bits}
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+        distance_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> "LSHIndex":
+        """Rebuild an index from `state`, without copying the arrays."""
+        index = cls.__new__(cls)
+        index.distance_function = distance_function
+        index.n_tables = parameters["n_tables"]
+        index.n_bits = parameters["n_bits"]
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        index.size = index.n_sorted = len(index.data)
+        index.pending_keys = np.empty((0, index.n_tables), dtype=np.int64)
+        index._pending_tables = None
+        return index
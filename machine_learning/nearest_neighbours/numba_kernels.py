@@ -0,0 +1,236 @@
+"""Numba compiled kernels for the k-nearest neighbours algorithm."""
+
+import numba
+import numpy as np
+
+# Metric codes understood by the compiled kernels.
+EUCLIDEAN = 0
+MANHATTAN = 1
+CHEBYSHEV = 2
+MINKOWSKI = 3
+
+
+def metric_code(
+    distance_metric: str,
+    p: float,
+) -> int:
+    """Map a metric name (and minkowski order) onto a compiled metric code."""
+    if distance_metric == "minkowski":
+        if p == 1:
+            return MANHATTAN
+        if p == 2:
+            return EUCLIDEAN
+        if np.isinf(p):
+            return CHEBYSHEV
+        return MINKOWSKI
+
+    codes = {
+        "euclidean": EUCLIDEAN,
+        "manhattan": MANHATTAN,
+        "chebyshev": CHEBYSHEV,
+    }
+    if distance_metric not in codes:
+        raise ValueError(
+            f"Distance metric '{distance_metric}' has no compiled kernel."
+        )
+    return codes[distance_metric]
+
+
+@numba.njit(inline="always", cache=True)
+def reduced_distance(
+    x1: np.ndarray,
+    x2: np.ndarray,
+    metric: int,
+    p: float,
+) -> float:
+    """
+    Distance without the final root, which does not change the ordering:
+    squared euclidean, and the sum of |a - b|^p for minkowski.
+    """
+    total = 0.0
+    for j in range(x1.shape[0]):
+        difference = abs(x1[j] - x2[j])
+        if metric == EUCLIDEAN:
+            total += difference * difference
+        elif metric == MANHATTAN:
+            total += difference
+        elif metric == CHEBYSHEV:
+            total = max(total, difference)
+        else:
+            total += difference**p
+    return total
+
+
+@numba.njit(inline="always", cache=True)
+def _is_worse(
+    distance_a: float,
+    index_a: int,
+    distance_b: float,
+    index_b: int,
+) -> bool:
+    """Order on (distance, index), so that ties go to the lowest index."""
+    return distance_a > distance_b or (
+        distance_a == distance_b and index_a > index_b
+    )
+
+
+@numba.njit(inline="always", cache=True)
+def _sift_down(
+    heap_distances: np.ndarray,
+    heap_idx: np.ndarray,
+    position: int,
+    size: int,
+) -> None:
+    """Restore the max-heap property below `position`."""
+    while True:
+        largest = position
+        left = 2 * position + 1
+        right = left + 1
+
+        if left < size and _is_worse(
+            heap_distances[left],
+            heap_idx[left],
+            heap_distances[largest],
+            heap_idx[largest],
+        ):
+            largest = left
+        if right < size and _is_worse(
+            heap_distances[right],
+            heap_idx[right],
+            heap_distances[largest],
+            heap_idx[largest],
+        ):
+            largest = right
+        if largest == position:
+            return
+
+        heap_distances[position], heap_distances[largest] = (
+            heap_distances[largest],
+            heap_distances[position],
+        )
+        heap_idx[position], heap_idx[largest] = (
+            heap_idx[largest],
+            heap_idx[position],
+        )
+        position = largest
+
+
+@numba.njit(parallel=True, cache=True)
+def fused_k_nearest(
+    X_query: np.ndarray,
+    X_train: np.ndarray,
+    k: int,
+    metric: int,
+    p: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute distances and select the k nearest training points in one pass.
+
+    Every query keeps a max-heap of its k best candidates, with the worst
+    candidate at the root. A training point only enters the heap when it beats
+    the root, so no distance array is ever materialized and the memory use is
+    O(k) per query. Queries are distributed over threads with prange.
+
+    Args:
+        X_query (np.ndarray): Query points of shape (n_query, d).
+        X_train (np.ndarray): Training points of shape (n_train, d).
+        k (int): Number of neighbours, at most n_train.
+        metric (int): One of the metric codes of this module.
+        p (float): Order of the minkowski metric.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Distances and indices, both of shape
+            (n_query, k), sorted on distance and then on index.
+    """
+    n_query = X_query.shape[0]
+    distances = np.empty((n_query, k))
+    indices = np.empty((n_query, k), dtype=np.int64)
+
+    for i in numba.prange(n_query):
+        heap_distances = distances[i]
+        heap_idx = indices[i]
+        heap_distances[:] = np.inf
+        heap_idx[:] = np.iinfo(np.int64).max
+
+        for j in range(X_train.shape[0]):
+            distance = reduced_distance(X_query[i], X_train[j], metric, p)
+
+            # Training indices only increase, so an equal distance never wins.
+            if distance < heap_distances[0]:
+                heap_distances[0] = distance
+                heap_idx[0] = j
+                _sift_down(heap_distances, heap_idx, 0, k)
+
+        # Heapsort, which leaves the buffer in ascending order.
+        for size in range(k - 1, 0, -1):
+            heap_distances[0], heap_distances[size] = (
+                heap_distances[size],
+                heap_distances[0],
+            )
+            heap_idx[0], heap_idx[size] = heap_idx[size], heap_idx[0]
+            _sift_down(heap_distances, heap_idx, 0, size)
+
+        for position in range(k):
+            if metric == EUCLIDEAN:
+                heap_distances[position] = np.sqrt(heap_distances[position])
+            elif metric == MINKOWSKI:
+                heap_distances[position] = heap_distances[position] ** (1 / p)
+
+    return distances, indices
+
+
+@numba.njit(parallel=True, cache=True)
+def sparse_products(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    data: np.ndarray,
+    column_indptr: np.ndarray,
+    column_rows: np.ndarray,
+    column_data: np.ndarray,
+    row_start: int,
+    row_stop: int,
+) -> np.ndarray:
+    """
+    Dot products between the rows of a CSR matrix and the rows
+    [row_start, row_stop) of a matrix in column-major (CSC) form.
+
+    For every nonzero of a query row, only the entries of the other matrix in
+    the same column are visited, so the work is proportional to the number of
+    pairs of nonzeros that share a column instead of to n1 * n2 * d. The
+    entries of a column are sorted on row, so the requested rows are found
+    with a binary search. Query rows are distributed over threads with prange.
+
+    Args:
+        indptr (np.ndarray): Row offsets of the queries, of shape (n1 + 1,).
+            They index into `indices` and `data`, and need not start at 0.
+        indices (np.ndarray): Column of every nonzero of the queries.
+        data (np.ndarray): Value of every nonzero of the queries.
+        column_indptr (np.ndarray): Column offsets of shape (d + 1,).
+        column_rows (np.ndarray): Row of every nonzero, sorted per column.
+        column_data (np.ndarray): Value of every nonzero.
+        row_start (int): First row of the column-major matrix.
+        row_stop (int): End of the rows of the column-major matrix.
+
+    Returns:
+        np.ndarray: Dense products of shape (n1, row_stop - row_start).
+    """
+    n1 = indptr.shape[0] - 1
+    products = np.zeros((n1, row_stop - row_start))
+
+    for i in numba.prange(n1):
+        for position in range(indptr[i], indptr[i + 1]):
+            column = indices[position]
+            value = data[position]
+
+            first = column_indptr[column]
+            last = column_indptr[column + 1]
+            rows = column_rows[first:last]
+            start = first + np.searchsorted(rows, row_start)
+            stop = first + np.searchsorted(rows, row_stop)
+
+            for entry in range(start, stop):
+                products[i, column_rows[entry] - row_start] += (
+                    value * column_data[entry]
+                )
+
+    return products
@@ -0,0 +1,71 @@
+"""
+Saving models as a directory of raw .npy arrays and a JSON file with the
+remaining parameters.
+
+Every array is written uncompressed with a header that is padded to a multiple
+of 64 bytes, so on load the data can be memory-mapped instead of read. Worker
+processes that load the same model then share one copy in the page cache, and
+loading takes milliseconds regardless of the size of the model.
+"""
+
+import json
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+# Name of the file with the parameters and the names of the arrays.
+METADATA_FILE = "metadata.json"
+
+
+def save_arrays(
+    path: Union[str, Path],
+    arrays: dict[str, np.ndarray],
+    parameters: dict,
+) -> None:
+    """
+    Write arrays and parameters to a directory.
+
+    Args:
+        path (str | Path): Directory, created if it does not exist.
+        arrays (dict[str, np.ndarray]): Arrays to write as <name>.npy. Object
+            arrays are not supported, since they cannot be memory-mapped.
+        parameters (dict): Everything else, must be JSON serializable.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", array, allow_pickle=False)
+
+    metadata = {"arrays": sorted(arrays), "parameters": parameters}
+    (path / METADATA_FILE).write_text(json.dumps(metadata, indent=4))
+
+
+def load_arrays(
+    path: Union[str, Path],
+    mmap: bool = True,
+) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Read a directory that was written with `save_arrays`.
+
+    Args:
+        path (str | Path): Directory.
+        mmap (bool): Memory-map the arrays read-only instead of reading them
+            into memory.
+
+    Returns:
+        tuple[dict[str, np.ndarray], dict]: The arrays and the parameters.
+    """
+    path = Path(path)
+    metadata = json.loads((path / METADATA_FILE).read_text())
+
+    # np.asarray turns the np.memmap into a plain array view on the mapping,
+    # which numba and the rest of the code treat like any other array.
+    arrays = {
+        name: np.asarray(
+            np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None)
+        )
+        for name in metadata["arrays"]
+    }
+    return arrays, metadata["parameters"]
@@ -0,0 +1,479 @@
+"""
+Asyncio server that predicts single query points in micro-batches.
+
+Online requests arrive one point at a time, and predicting them one by one
+loses the benefit of vectorized distance computation. The MicroBatcher
+collects concurrent requests until a batch is full or the first request in it
+has waited long enough, predicts the whole batch at once on a worker thread,
+and resolves the future of every request. The event loop keeps collecting
+the next batch in the meantime.
+
+The server speaks newline-delimited JSON over TCP: every request line is
+{"x": [x_1, ..., x_d]} and is answered by {"prediction": label}, or by
+{"error": message}.
+
+    python prediction_server.py model_directory --port 8000
+    python prediction_server.py model_directory --loopback queries.npy
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from knn import KNNClassifier
+
+# Default largest number of requests that are predicted together.
+MAX_BATCH_SIZE = 256
+
+# Default time in milliseconds that the first request of a batch waits for
+# others to join it.
+MAX_WAIT_MS = 2.0
+
+# Number of most recent request latencies that the percentiles are taken over.
+LATENCY_WINDOW = 10_000
+
+# Default number of concurrent connections of the loopback client.
+N_CLIENTS = 64
+
+
+class MicroBatcher:
+    """
+    Collects single-point requests into batches for a fitted classifier.
+
+    Batches are predicted one at a time on a single worker thread, so requests
+    that arrive while a batch is being predicted form the next batch. Under
+    light load a request waits at most `max_wait_ms`, under heavy load the
+    batches grow up to `max_batch_size`.
+    """
+
+    def __init__(
+        self,
+        classifier: KNNClassifier,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ) -> None:
+        """
+        Initialising the MicroBatcher class.
+
+        Args:
+            classifier (KNNClassifier): A fitted classifier.
+            max_batch_size (int): Largest number of requests per batch.
+            max_wait_ms (float): Longest time that the first request of a batch
+                waits for more requests, in milliseconds.
+        """
+        if max_batch_size < 1:
+            raise ValueError("Parameter 'max_batch_size' must be at least 1.")
+        if max_wait_ms < 0:
+            raise ValueError("Parameter 'max_wait_ms' must be at least 0.")
+
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        # Latency of every request in seconds, from submission to result.
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.n_batches = 0
+        self.n_requests = 0
+
+        self._queue = None
+        # Set whenever a request is queued, see `_collect`.
+        self._arrived = None
+        self._task = None
+        self._executor = None
+
+    @property
+    def n_dimensions(self) -> Optional[int]:
+        """
+        Dimension of the query points, None while the classifier does not
+        know it yet (a ChunkSource that was not scanned).
+        """
+        return self.classifier.n_dimensions
+
+    async def start(self) -> None:
+        """Start collecting and predicting batches."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop predicting, requests that are still queued get an error."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._executor.shutdown(wait=True)
+
+        queued = []
+        while not self._queue.empty():
+            queued.append(self._queue.get_nowait())
+        _fail(queued, RuntimeError("The batcher was stopped."))
+
+    async def __aenter__(self) -> "MicroBatcher":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    async def predict(
+        self,
+        x: list[float],
+    ) -> Any:
+        """
+        Predict one query point as part of the next batch.
+
+        Args:
+            x (list[float]): Query point of shape (d,).
+
+        Returns:
+            The predicted class.
+        """
+        if self._task is None:
+            raise RuntimeError("The batcher is not started.")
+
+        x = np.asarray(x, dtype=float)
+        if x.ndim != 1 or (
+            self.n_dimensions is not None and len(x) != self.n_dimensions
+        ):
+            raise ValueError(
+                f"Expected a point of shape ({self.n_dimensions},), but got "
+                f"shape {x.shape}."
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((x, future, time.perf_counter()))
+        self._arrived.set()
+        return await future
+
+    async def _collect(
+        self,
+        batch: list[tuple],
+    ) -> None:
+        """
+        Wait for a request, then collect more until the batch is full.
+
+        Before Python 3.12, asyncio.wait_for can lose an item that
+        `Queue.get` took off the queue just as the timeout fired. The timeout
+        is therefore only put on waiting for the next arrival, and requests
+        are only taken off the queue with get_nowait, so a request that
+        arrives at the deadline stays queued for the next batch.
+        """
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _matching_dimensions(
+        self,
+        batch: list[tuple],
+    ) -> list[tuple]:
+        """
+        Fail the requests whose point does not have the dimension of the
+        classifier, and return the others. While the classifier does not know
+        its dimension, the most common one in the batch is predicted.
+        """
+        n_dimensions = self.n_dimensions
+        if n_dimensions is None:
+            lengths = [len(x) for x, _, _ in batch]
+            n_dimensions = max(set(lengths), key=lengths.count)
+
+        matching = [
+            request for request in batch if len(request[0]) == n_dimensions
+        ]
+        if len(matching) < len(batch):
+            _fail(
+                [
+                    request
+                    for request in batch
+                    if len(request[0]) != n_dimensions
+                ],
+                ValueError(f"Expected a point of shape ({n_dimensions},)."),
+            )
+        return matching
+
+    async def _predict_batch(
+        self,
+        batch: list[tuple],
+    ) -> None:
+        """
+        Predict a batch on the worker thread and resolve its futures.
+
+        A single point can make the prediction of a whole batch fail, such as
+        an outlier of a RadiusNeighborsClassifier without an outlier label.
+        The requests of a failed batch are then predicted one at a time, so a
+        request only fails because of its own point.
+        """
+        try:
+            batch = self._matching_dimensions(batch)
+            if not batch:
+                return
+            predictions = await self._predict(
+                np.stack([x for x, _, _ in batch])
+            )
+        except Exception as error:
+            if len(batch) == 1:
+                _fail(batch, error)
+                return
+
+            predicted = []
+            predictions = []
+            for request in batch:
+                try:
+                    (prediction,) = await self._predict(
+                        request[0][np.newaxis, :]
+                    )
+                except Exception as request_error:
+                    _fail([request], request_error)
+                    continue
+                predicted.append(request)
+                predictions.append(prediction)
+            batch = predicted
+
+        finished = time.perf_counter()
+        for (_, future, submitted), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(prediction)
+                self.latencies.append(finished - submitted)
+
+        self.n_batches += 1
+        self.n_requests += len(batch)
+
+    async def _predict(
+        self,
+        X: np.ndarray,
+    ) -> list:
+        """Predict query points on the worker thread."""
+        predictions = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.classifier.predict, X
+        )
+        # tolist turns NumPy scalars into Python objects, which JSON needs.
+        return np.asarray(predictions).tolist()
+
+    async def _run(self) -> None:
+        """Collect and predict batches until cancelled."""
+        while True:
+            # The batch is filled in place, so that the requests in it can be
+            # failed when the batcher is stopped halfway.
+            batch = []
+            try:
+                await self._collect(batch)
+                # Requests whose caller went away do not need a prediction.
+                batch = [request for request in batch if not request[1].done()]
+                if batch:
+                    await self._predict_batch(batch)
+            except asyncio.CancelledError:
+                _fail(batch, RuntimeError("The batcher was stopped."))
+                raise
+            except Exception as error:
+                # Keep serving, an error must not leave later requests waiting.
+                _fail(batch, error)
+
+    def stats(self) -> dict:
+        """
+        Latency percentiles in milliseconds over the last LATENCY_WINDOW
+        requests, and the number and average size of the batches.
+        """
+        latencies = np.array(self.latencies) * 1000
+        p50, p99 = (
+            np.percentile(latencies, [50, 99]) if len(latencies) else (0, 0)
+        )
+        return {
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+            "n_requests": self.n_requests,
+            "n_batches": self.n_batches,
+            "mean_batch_size": self.n_requests / max(self.n_batches, 1),
+        }
+
+
+def _fail(
+    requests: list[tuple],
+    error: Exception,
+) -> None:
+    """Raise an error in the callers of requests that are still waiting."""
+    for _, future, _ in requests:
+        if not future.done():
+            future.set_exception(error)
+
+
+async def _handle_connection(
+    batcher: MicroBatcher,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    """Answer the request lines of one connection in order."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                prediction = await batcher.predict(json.loads(line)["x"])
+                response = {"prediction": prediction}
+            except Exception as error:
+                response = {"error": f"{type(error).__name__}: {error}"}
+
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(
+    batcher: MicroBatcher,
+    host: str = "127.0.0.1",
+    port: int = 0,
+) -> asyncio.AbstractServer:
+    """
+    Serve a started batcher over TCP.
+
+    Args:
+        batcher (MicroBatcher): Batcher whose predictions are served.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 picks a free port.
+
+    Returns:
+        asyncio.AbstractServer: The server, its `sockets` hold the address.
+    """
+    return await asyncio.start_server(
+        lambda reader, writer: _handle_connection(batcher, reader, writer),
+        host,
+        port,
+    )
+
+
+async def run_loopback(
+    classifier: KNNClassifier,
+    X: np.ndarray,
+    n_clients: int = N_CLIENTS,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait_ms: float = MAX_WAIT_MS,
+) -> tuple[np.ndarray, dict]:
+    """
+    Start a server on a free local port and send it every row of X, from
+    n_clients concurrent connections that each send one request at a time.
+
+    Returns:
+        tuple[np.ndarray, dict]: The predictions in the order of X, and the
+            client-side latency percentiles in milliseconds together with the
+            batch statistics of the server.
+    """
+    predictions = [None] * len(X)
+    latencies = []
+
+    async with MicroBatcher(classifier, max_batch_size, max_wait_ms) as batcher:
+        server = await start_server(batcher)
+        host, port = server.sockets[0].getsockname()[:2]
+
+        async def client(rows: range) -> None:
+            reader, writer = await asyncio.open_connection(host, port)
+            for i in rows:
+                start = time.perf_counter()
+                request = {"x": X[i].tolist()}
+                writer.write(json.dumps(request).encode() + b"\n")
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - start)
+                predictions[i] = response.get("prediction")
+            writer.close()
+
+        await asyncio.gather(
+            *(client(range(i, len(X), n_clients)) for i in range(n_clients))
+        )
+        server.close()
+        await server.wait_closed()
+        stats = batcher.stats()
+
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    stats.update({"client_p50_ms": float(p50), "client_p99_ms": float(p99)})
+    return np.array(predictions), stats
+
+
+async def _serve(
+    batcher: MicroBatcher,
+    host: str,
+    port: int,
+) -> None:
+    """Serve until interrupted."""
+    async with batcher:
+        server = await start_server(batcher, host, port)
+        print(f"Serving on {host}:{server.sockets[0].getsockname()[1]}.")
+        async with server:
+            await server.serve_forever()
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve a saved KNNClassifier with micro-batching."
+    )
+    parser.add_argument(
+        "model",
+        type=Path,
+        help="Directory written by the save method of a KNNClassifier or "
+        "a RadiusNeighborsClassifier.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument(
+        "--loopback",
+        type=Path,
+        help="Instead of serving, send the points of this .npy file to a "
+        "local server and report the latency.",
+    )
+    parser.add_argument("--clients", type=int, default=N_CLIENTS)
+    args = parser.parse_args(arguments)
+
+    classifier = KNNClassifier.load(args.model)
+
+    if args.loopback is None:
+        batcher = MicroBatcher(
+            classifier, args.max_batch_size, args.max_wait_ms
+        )
+        asyncio.run(_serve(batcher, args.host, args.port))
+        return
+
+    X = np.load(args.loopback)
+    _, stats = asyncio.run(
+        run_loopback(
+            classifier,
+            X,
+            args.clients,
+            args.max_batch_size,
+            args.max_wait_ms,
+        )
+    )
+    print(json.dumps(stats, indent=4))
+
+
+if __name__ == "__main__":
+    main()
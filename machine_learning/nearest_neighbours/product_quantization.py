@@ -0,0 +1,320 @@
+"""
+Product quantization: compressed storage of the training points, searched
+with asymmetric distance lookup tables.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from buffers import append
+from distance_metrics import euclidean_distances, squared_norms
+from selection import merge_top_k, select_top_k
+
+# Default number of subspaces, or the number of dimensions when there are
+# fewer. Every point is stored as one code per subspace.
+N_SUBSPACES = 8
+
+# Default number of bits per code, so 2^N_BITS centroids per subspace.
+N_BITS = 8
+
+# Number of Lloyd iterations of the k-means clustering of every subspace.
+N_ITERATIONS = 20
+
+# At most this many points are used to learn the centroids.
+MAX_TRAINING_SAMPLES = 65_536
+
+# Number of training codes that are scanned at once during a query.
+CODE_CHUNK_SIZE = 65_536
+
+
+def _nearest_centroid(
+    X: np.ndarray,
+    centroids: np.ndarray,
+) -> np.ndarray:
+    """
+    Index of the nearest centroid of every row of X, chunk by chunk.
+
+    ||x||^2 is the same for every centroid, so ||c||^2 - 2 x.c is enough to
+    find the nearest one, without the square root of a full distance matrix.
+    """
+    labels = np.empty(len(X), dtype=np.int64)
+    centroid_norms = squared_norms(centroids)
+
+    for start in range(0, len(X), CODE_CHUNK_SIZE):
+        stop = start + CODE_CHUNK_SIZE
+        scores = centroid_norms - 2 * X[start:stop] @ centroids.T
+        labels[start:stop] = np.argmin(scores, axis=1)
+
+    return labels
+
+
+def k_means(
+    X: np.ndarray,
+    n_clusters: int,
+    n_iterations: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Lloyd's k-means clustering.
+
+    Args:
+        X (np.ndarray): Points of shape (n, d).
+        n_clusters (int): Number of centroids. When there are fewer points,
+            the remaining centroids are duplicates.
+        n_iterations (int): Number of assignment and update steps.
+        rng (np.random.Generator): Used to pick the initial centroids.
+
+    Returns:
+        np.ndarray: Centroids of shape (n_clusters, d).
+    """
+    initial = rng.choice(len(X), size=n_clusters, replace=len(X) < n_clusters)
+    centroids = X[initial].copy()
+
+    for _ in range(n_iterations):
+        labels = _nearest_centroid(X, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack(
+            [
+                np.bincount(labels, weights=X[:, j], minlength=n_clusters)
+                for j in range(X.shape[1])
+            ],
+            axis=1,
+        )
+
+        # Empty clusters keep their previous centroid.
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+    return centroids
+
+
+class ProductQuantizationIndex:
+    """
+    Product quantization of the training points.
+
+    The dimensions are split into subspaces, and the sub-vectors of every
+    subspace are clustered with k-means. A point is then stored as the index of
+    its nearest centroid in every subspace, one byte per subspace instead of
+    8 bytes per dimension.
+
+    A query is not quantized. Its squared distance to every centroid of every
+    subspace is put in a lookup table once, after which the approximate
+    distance to any stored point is a sum of table entries, one per subspace.
+    Optionally, the best candidates are re-ranked with their exact distances,
+    which requires keeping the original points. Points that are added later
+    are compressed with the centroids that were learned at construction.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        n_subspaces: Optional[int] = None,
+        n_bits: int = N_BITS,
+        n_iterations: int = N_ITERATIONS,
+        rerank: int = 0,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Learn the centroids and compress the points.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            n_subspaces (int, optional): Number of subspaces, at most d.
+                Dimensions are divided as evenly as possible. Defaults to
+                min(N_SUBSPACES, d).
+            n_bits (int): Bits per code, at most 8 so a code fits in a byte.
+            n_iterations (int): Number of k-means iterations.
+            rerank (int): Number of approximate candidates per query that are
+                re-ranked with exact distances. 0 disables re-ranking and
+                discards the original points.
+            seed (int, optional): Seed for sampling and initialising k-means.
+        """
+        X = np.asarray(X, dtype=float)
+
+        if len(X) == 0:
+            raise ValueError("Cannot quantize an empty dataset.")
+        if n_subspaces is None:
+            n_subspaces = min(N_SUBSPACES, X.shape[1])
+        if not 1 <= n_subspaces <= X.shape[1]:
+            raise ValueError(
+                f"Parameter 'n_subspaces' must be between 1 and {X.shape[1]}."
+            )
+        if not 1 <= n_bits <= 8:
+            raise ValueError("Parameter 'n_bits' must be between 1 and 8.")
+
+        self.n_samples = 0
+        self.n_clusters = 2**n_bits
+        self.rerank = rerank
+        self.data = np.empty((0, X.shape[1])) if rerank > 0 else None
+        self.code_buffer = np.empty((0, n_subspaces), dtype=np.uint8)
+        self.subspaces = np.array_split(np.arange(X.shape[1]), n_subspaces)
+
+        rng = np.random.default_rng(seed)
+        sample = X[
+            rng.choice(
+                len(X),
+                size=min(len(X), MAX_TRAINING_SAMPLES),
+                replace=False,
+            )
+        ]
+
+        self.centroids = [
+            k_means(
+                np.ascontiguousarray(sample[:, dims]),
+                self.n_clusters,
+                n_iterations,
+                rng,
+            )
+            for dims in self.subspaces
+        ]
+        self.add(X)
+
+    @property
+    def X(self) -> Optional[np.ndarray]:
+        """The original points when they are kept for re-ranking."""
+        if self.data is None:
+            return None
+        return self.data[: self.n_samples]
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Codes of the stored points, shape (n_samples, n_subspaces)."""
+        return self.code_buffer[: self.n_samples]
+
+    def add(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Compress new points with the existing centroids.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d). They get the ids
+                n_samples, ..., n_samples + n - 1.
+        """
+        X = np.asarray(X, dtype=float)
+        codes = np.empty((len(X), len(self.subspaces)), dtype=np.uint8)
+        for j, dims in enumerate(self.subspaces):
+            codes[:, j] = _nearest_centroid(X[:, dims], self.centroids[j])
+
+        self.code_buffer = append(self.code_buffer, self.n_samples, codes)
+        if self.data is not None:
+            self.data = append(self.data, self.n_samples, X)
+        self.n_samples += len(X)
+
+    def _distance_tables(
+        self,
+        X: np.ndarray,
+    ) -> np.ndarray:
+        """Squared distances of shape (n_query, n_subspaces, n_clusters)."""
+        return np.stack(
+            [
+                euclidean_distances(X[:, dims], centroids) ** 2
+                for dims, centroids in zip(self.subspaces, self.centroids)
+            ],
+            axis=1,
+        )
+
+    def approximate_distances(
+        self,
+        tables: np.ndarray,
+        start: int,
+        stop: int,
+    ) -> np.ndarray:
+        """
+        Approximate squared distances from the queries to the stored points
+        start, ..., stop - 1, by summing lookup table entries.
+        """
+        codes = self.codes[start:stop]
+        distances = np.zeros((len(tables), len(codes)))
+
+        for j in range(codes.shape[1]):
+            distances += tables[:, j, codes[:, j]]
+
+        return distances
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find approximately the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours, at most the number of points.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Euclidean distances (approximate
+                unless re-ranked) and indices, both of shape (n_query, k),
+                ordered from nearest to furthest.
+        """
+        if not 1 <= k <= self.n_samples:
+            raise ValueError(
+                f"Expected 1 <= k <= {self.n_samples}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=float)
+        n_candidates = min(max(k, self.rerank), self.n_samples)
+        tables = self._distance_tables(X)
+
+        best_distances = np.full((len(X), n_candidates), np.inf)
+        best_idx = np.full((len(X), n_candidates), -1)
+
+        for start in range(0, self.n_samples, CODE_CHUNK_SIZE):
+            stop = min(start + CODE_CHUNK_SIZE, self.n_samples)
+            best_distances, best_idx = merge_top_k(
+                best_distances,
+                best_idx,
+                self.approximate_distances(tables, start, stop),
+                np.arange(start, stop),
+                n_candidates,
+            )
+
+        if self.X is None:
+            return np.sqrt(best_distances[:, :k]), best_idx[:, :k]
+
+        exact_distances = np.sqrt(
+            np.sum((self.X[best_idx] - X[:, np.newaxis, :]) ** 2, axis=2)
+        )
+        return select_top_k(exact_distances, best_idx, k)
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Arrays and parameters from which `from_state` rebuilds the index."""
+        # The centroids of all subspaces side by side, shape (n_clusters, d).
+        arrays = {
+            "codes": self.codes,
+            "centroids": np.concatenate(self.centroids, axis=1),
+        }
+        if self.X is not None:
+            arrays["data"] = self.X
+
+        parameters = {
+            "n_subspaces": len(self.subspaces),
+            "n_clusters": self.n_clusters,
+            "rerank": self.rerank,
+        }
+        return arrays, parameters
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+    ) -> "ProductQuantizationIndex":
+        """Rebuild an index from `state`, without copying the arrays."""
+        centroids = arrays["centroids"]
+
+        index = cls.__new__(cls)
+        index.n_clusters = parameters["n_clusters"]
+        index.rerank = parameters["rerank"]
+        index.data = arrays.get("data")
+        index.code_buffer = arrays["codes"]
+        index.n_samples = len(index.code_buffer)
+        index.subspaces = np.array_split(
+            np.arange(centroids.shape[1]), parameters["n_subspaces"]
+        )
+        index.centroids = [centroids[:, dims] for dims in index.subspaces]
+        return index
@@ -0,0 +1,140 @@
+"""Classification by a vote of all training points within a fixed radius."""
+
+from typing import Any, Optional
+
+import numpy as np
+
+from kd_tree import LEAF_SIZE
+from knn import KNNClassifier
+
+
+class RadiusNeighborsClassifier(KNNClassifier):
+    """
+    Class for classification according to the radius neighbours algorithm.
+
+    Instead of the k nearest training points, all training points within
+    `radius` of a query vote on its class. Fitting, the indices, partial_fit
+    and save/load are shared with the KNNClassifier.
+    """
+
+    def __init__(
+        self,
+        radius: float,
+        distance_metric: str = "euclidean",
+        algorithm: str = "auto",
+        leaf_size: int = LEAF_SIZE,
+        p: float = 2,
+        n_jobs: int = 1,
+        index_params: Optional[dict] = None,
+        outlier_label: Any = None,
+        dtype: str = "float64",
+    ) -> None:
+        """
+        Initialising the RadiusNeighborsClassifier class.
+
+        Args:
+            radius (float): Training points within this distance of a query
+                vote on its class.
+            distance_metric (str): See KNNClassifier.
+            algorithm (str): See KNNClassifier. Only "kd_tree", "ball_tree"
+                and "grid" use their index for radius queries, the other
+                algorithms scan all training points.
+            leaf_size (int): See KNNClassifier.
+            p (float): See KNNClassifier.
+            n_jobs (int): See KNNClassifier.
+            index_params (dict, optional): See KNNClassifier.
+            outlier_label (optional): Prediction for queries without any
+                training point within the radius. When omitted, such queries
+                raise a ValueError.
+            dtype (str): See KNNClassifier.
+        """
+        if radius < 0:
+            raise ValueError("Parameter 'radius' must be at least 0.")
+
+        super().__init__(
+            k=1,
+            distance_metric=distance_metric,
+            algorithm=algorithm,
+            leaf_size=leaf_size,
+            p=p,
+            n_jobs=n_jobs,
+            index_params=index_params,
+            dtype=dtype,
+        )
+        self.radius = radius
+        self.outlier_label = outlier_label
+
+    def _init_parameters(self) -> dict:
+        """Arguments of __init__ that recreate this classifier, for `load`."""
+        parameters = super()._init_parameters()
+        del parameters["k"], parameters["cache_k"]
+        parameters["radius"] = self.radius
+        parameters["outlier_label"] = self.outlier_label
+        return parameters
+
+    def _vote_radius(
+        self,
+        offsets: np.ndarray,
+        neighbors_idx: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Majority vote over a varying number of neighbours per query.
+
+        Like the KNNClassifier, classes are counted with a single bincount, and
+        when several classes get the same number of votes, the class of the
+        nearest neighbour among them wins.
+
+        Args:
+            offsets (np.ndarray): CSR-style offsets of shape (n_query + 1,).
+            neighbors_idx (np.ndarray): Indices into X_train, sorted from
+                nearest to furthest within every query.
+
+        Returns:
+            np.ndarray: Encoded predicted class of every query, of shape
+                (n_query,). Queries without neighbours get len(classes).
+        """
+        n_query = len(offsets) - 1
+        n_classes = len(self.classes)
+        lengths = np.diff(offsets)
+        max_length = lengths.max(initial=0)
+
+        rows = np.repeat(np.arange(n_query), lengths)
+        keys = rows * n_classes + self.y_train_encoded[neighbors_idx]
+        counts = np.bincount(keys, minlength=n_query * n_classes)
+
+        # The neighbours are sorted, so the first occurrence of a class within
+        # a query is its nearest neighbour.
+        nearest_rank = np.full(n_query * n_classes, max_length)
+        unique_keys, first = np.unique(keys, return_index=True)
+        nearest_rank[unique_keys] = first - offsets[rows[first]]
+
+        scores = counts * (max_length + 1) - nearest_rank
+        predicted = np.argmax(scores.reshape(n_query, n_classes), axis=1)
+        predicted[lengths == 0] = n_classes
+
+        return predicted
+
+    def _predict_batch(
+        self,
+        X: np.ndarray,
+        chunk_size: Optional[int],
+        max_memory_mb: float,
+        k: Optional[int] = None,
+    ) -> np.ndarray:
+        """Predict one array of query points, k is not used."""
+        offsets, neighbors_idx, _ = self.radius_neighbors(
+            X, self.radius, chunk_size, max_memory_mb
+        )
+        predicted = self._vote_radius(offsets, neighbors_idx)
+
+        if self.outlier_label is not None:
+            return np.append(self.classes, [self.outlier_label])[predicted]
+
+        n_outliers = np.count_nonzero(predicted == len(self.classes))
+        if n_outliers:
+            raise ValueError(
+                f"{n_outliers} query points have no training points within "
+                f"radius {self.radius}, set 'outlier_label' to predict them."
+            )
+
+        return self.classes[predicted]
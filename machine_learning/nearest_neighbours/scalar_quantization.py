@@ -0,0 +1,183 @@
+"""
+Scalar quantization: a brute force scan over int8 codes of the training
+points, followed by exact re-ranking of the best candidates.
+"""
+
+import numpy as np
+
+from buffers import append
+from distance_metrics import squared_norms
+from selection import merge_top_k, select_top_k
+
+# Default number of candidates per query that are re-ranked with the float
+# points. Never fewer than k.
+RERANK = 32
+
+# Number of codes that are converted to float32 and scanned at once, small
+# enough for the converted block to stay in cache.
+CODE_CHUNK_SIZE = 4096
+
+
+class ScalarQuantizationIndex:
+    """
+    Every dimension is quantized independently to 256 levels between its
+    minimum and maximum at construction, so a point is stored as d bytes.
+
+    A query is not quantized. With x_hat = center + scale * code,
+    ||x - x_hat||^2 = ||x - center||^2 - 2 ((x - center) * scale).code
+    + ||scale * code||^2, and the first term is the same for every candidate.
+    The scan therefore only reads the codes and one precomputed norm per
+    point, and ranks them with a matrix product. The best `rerank` candidates
+    are then compared exactly with the float32 points, which are only read at
+    those rows. Points that are added later are quantized with the same
+    levels, coordinates outside the original range are clipped.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        rerank: int = RERANK,
+    ) -> None:
+        """
+        Learn the levels and quantize the points.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d).
+            rerank (int): Number of candidates per query that are re-ranked
+                with exact distances, at least k is always used.
+        """
+        X = np.asarray(X, dtype=np.float32)
+
+        if len(X) == 0:
+            raise ValueError("Cannot quantize an empty dataset.")
+        if rerank < 0:
+            raise ValueError("Parameter 'rerank' must be at least 0.")
+
+        minimum = X.min(axis=0)
+        extent = X.max(axis=0) - minimum
+        self.scale = np.where(extent > 0, extent / 255, 1).astype(np.float32)
+        # Code 0 is the middle of the range, so that codes fit in an int8.
+        self.center = minimum + 128 * self.scale
+        self.rerank = rerank
+
+        self.n_samples = 0
+        self.data = np.empty((0, X.shape[1]), dtype=np.float32)
+        self.code_buffer = np.empty((0, X.shape[1]), dtype=np.int8)
+        self.norm_buffer = np.empty(0, dtype=np.float32)
+        self.add(X)
+
+    @property
+    def X(self) -> np.ndarray:
+        """The float32 points that candidates are re-ranked with."""
+        return self.data[: self.n_samples]
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Codes of the stored points, shape (n_samples, d)."""
+        return self.code_buffer[: self.n_samples]
+
+    @property
+    def code_norms(self) -> np.ndarray:
+        """||scale * code||^2 of the stored points, shape (n_samples,)."""
+        return self.norm_buffer[: self.n_samples]
+
+    def add(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Quantize new points with the existing levels.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d). They get the ids
+                n_samples, ..., n_samples + n - 1.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        codes = np.clip(np.rint((X - self.center) / self.scale), -128, 127)
+        scaled = codes * self.scale
+
+        self.code_buffer = append(
+            self.code_buffer, self.n_samples, codes.astype(np.int8)
+        )
+        self.norm_buffer = append(
+            self.norm_buffer, self.n_samples, squared_norms(scaled)
+        )
+        self.data = append(self.data, self.n_samples, X)
+        self.n_samples += len(X)
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find approximately the k nearest neighbours of every query point.
+
+        Args:
+            X (np.ndarray): Query points of shape (n_query, d).
+            k (int): Number of neighbours, at most the number of points.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Exact euclidean distances and
+                indices of the re-ranked candidates, both of shape
+                (n_query, k), ordered from nearest to furthest.
+        """
+        if not 1 <= k <= self.n_samples:
+            raise ValueError(
+                f"Expected 1 <= k <= {self.n_samples}, but got k={k}."
+            )
+
+        X = np.asarray(X, dtype=np.float32)
+        n_candidates = min(max(k, self.rerank), self.n_samples)
+        weights = (X - self.center) * self.scale
+
+        best_scores = np.full((len(X), n_candidates), np.inf, dtype=np.float32)
+        best_idx = np.full((len(X), n_candidates), -1)
+
+        for start in range(0, self.n_samples, CODE_CHUNK_SIZE):
+            stop = min(start + CODE_CHUNK_SIZE, self.n_samples)
+            # Squared distances up to a constant per query.
+            scores = self.code_norms[start:stop] - 2 * (
+                weights @ self.codes[start:stop].T.astype(np.float32)
+            )
+            best_scores, best_idx = merge_top_k(
+                best_scores,
+                best_idx,
+                scores,
+                np.arange(start, stop),
+                n_candidates,
+            )
+
+        differences = self.X[best_idx] - X[:, np.newaxis, :]
+        exact_distances = np.sqrt(
+            np.einsum("ijk,ijk->ij", differences, differences)
+        )
+        return select_top_k(exact_distances, best_idx, k)
+
+    def state(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Arrays and parameters from which `from_state` rebuilds the index."""
+        arrays = {
+            "codes": self.codes,
+            "code_norms": self.code_norms,
+            "data": self.X,
+            "center": self.center,
+            "scale": self.scale,
+        }
+        return arrays, {"rerank": self.rerank}
+
+    @classmethod
+    def from_state(
+        cls,
+        arrays: dict[str, np.ndarray],
+        parameters: dict,
+    ) -> "ScalarQuantizationIndex":
+        """Rebuild an index from `state`, without copying the arrays."""
+        index = cls.__new__(cls)
+        index.rerank = parameters["rerank"]
+        index.center = arrays["center"]
+        index.scale = arrays["scale"]
+        index.data = arrays["data"]
+        index.code_buffer = arrays["codes"]
+        index.norm_buffer = arrays["code_norms"]
+        index.n_samples = len(index.code_buffer)
+        return index
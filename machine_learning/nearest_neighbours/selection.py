@@ -0,0 +1,105 @@
+"""Vectorized selection and grouping of the nearest candidates per query."""
+
+import numpy as np
+
+
+def select_top_k(
+    distances: np.ndarray,
+    idx: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Select the k smallest distances of every row in O(m) instead of O(m log m).
+
+    np.partition finds the k-th smallest distance of every row without sorting
+    the rest. Everything up to and including that distance is a candidate,
+    which is exactly k values per row unless there are ties at the boundary.
+    Only those candidates are sorted, on distance and then on index, so that
+    ties are always resolved in favour of the lowest training index.
+
+    Args:
+        distances (np.ndarray): Distances of shape (n, m), with m >= k.
+        idx (np.ndarray): Training indices of the columns, of shape (m,) or
+            (n, m).
+        k (int): Number of neighbours to keep.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Distances and indices of the k nearest
+            candidates, both of shape (n, k), sorted on distance and index.
+    """
+    n, m = distances.shape
+    idx = np.broadcast_to(idx, distances.shape)
+
+    if k < m:
+        kth_distances = np.partition(distances, k - 1, axis=1)[:, k - 1]
+        rows, cols = np.nonzero(distances <= kth_distances[:, np.newaxis])
+    else:
+        rows, cols = np.divmod(np.arange(n * m), m)
+
+    candidate_distances = distances[rows, cols]
+    candidate_idx = idx[rows, cols]
+    order = np.lexsort((candidate_idx, candidate_distances, rows))
+
+    # Every row has at least k candidates, keep the first k of each row.
+    row_starts = np.searchsorted(rows, np.arange(n))
+    selection = order[row_starts[:, np.newaxis] + np.arange(k)]
+
+    return candidate_distances[selection], candidate_idx[selection]
+
+
+def merge_top_k(
+    best_distances: np.ndarray,
+    best_idx: np.ndarray,
+    distances: np.ndarray,
+    idx: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge a block of new candidates into the running top-k of every query.
+
+    Args:
+        best_distances (np.ndarray): Current best distances, shape (n, k).
+        best_idx (np.ndarray): Training indices belonging to best_distances,
+            shape (n, k).
+        distances (np.ndarray): Distances to the new candidates, shape (n, m).
+        idx (np.ndarray): Training indices of the new candidates, shape (m,).
+        k (int): Number of neighbours to keep.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The new best distances and indices, both
+            of shape (n, k), sorted on distance and then on index.
+    """
+    candidate_distances = np.concatenate((best_distances, distances), axis=1)
+    candidate_idx = np.concatenate(
+        (best_idx, np.broadcast_to(idx, distances.shape)), axis=1
+    )
+
+    return select_top_k(candidate_distances, candidate_idx, k)
+
+
+def group_by_row(
+    rows: np.ndarray,
+    idx: np.ndarray,
+    distances: np.ndarray,
+    n_rows: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Turn (row, index, distance) triplets into CSR-style arrays.
+
+    Args:
+        rows (np.ndarray): Query of every pair, shape (m,).
+        idx (np.ndarray): Training index of every pair, shape (m,).
+        distances (np.ndarray): Distance of every pair, shape (m,).
+        n_rows (int): Number of queries.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Offsets of shape
+            (n_rows + 1,), and the indices and distances of the pairs. The
+            pairs of query i are at offsets[i]:offsets[i + 1], sorted on
+            distance and then on index.
+    """
+    order = np.lexsort((idx, distances, rows))
+    offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(rows, minlength=n_rows)))
+    )
+    return offsets, idx[order], distances[order]
@@ -0,0 +1,247 @@
+"""
+Sparse training and query points in compressed sparse row (CSR) format.
+
+Text and one-hot features have only a few nonzeros per row, so densifying them
+costs orders of magnitude more memory and time than the nonzeros themselves.
+Any object with the `indptr`, `indices`, `data` and `shape` attributes of a CSR
+matrix is accepted, such as a scipy.sparse csr_matrix or csr_array, without
+depending on scipy. The euclidean and cosine distances only need dot products
+and row norms, which are computed from the nonzeros alone.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from distance_metrics import cosine_from_products, euclidean_from_products
+
+# Distance metrics that are computed from sparse dot products.
+SPARSE_METRICS = ["euclidean", "cosine"]
+
+
+class CSRMatrix:
+    """
+    Rows of a sparse matrix. The nonzeros of row i are
+    data[indptr[i] : indptr[i + 1]], in the columns
+    indices[indptr[i] : indptr[i + 1]].
+
+    Slicing rows shares the arrays with the original matrix. The column-major
+    copy of the nonzeros that the dot products need is built once on the
+    original matrix, and a slice only selects its range of rows from it.
+    """
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        shape: tuple[int, int],
+    ) -> None:
+        """
+        Wrap the arrays of a CSR matrix, without copying them.
+
+        Args:
+            indptr (np.ndarray): Row offsets of shape (n + 1,).
+            indices (np.ndarray): Column of every nonzero. Duplicate columns
+                within a row are not supported.
+            data (np.ndarray): Value of every nonzero.
+            shape (tuple[int, int]): Number of rows and columns.
+        """
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.data = np.asarray(data, dtype=float)
+        self.shape = (int(shape[0]), int(shape[1]))
+
+        if len(self.indptr) != self.shape[0] + 1:
+            raise ValueError(
+                f"Expected {self.shape[0] + 1} row offsets, but got "
+                f"{len(self.indptr)}."
+            )
+
+        # The matrix that the rows were sliced from, and the first row in it.
+        self._base = self
+        self._row_start = 0
+        self._columns = None
+
+    @classmethod
+    def from_dense(
+        cls,
+        X: np.ndarray,
+    ) -> "CSRMatrix":
+        """Convert a dense array of shape (n, d), keeping only the nonzeros."""
+        X = np.asarray(X, dtype=float)
+        if X.ndim != 2:
+            raise ValueError("Expected an array of shape (n, d).")
+
+        rows, columns = np.nonzero(X)
+        indptr = np.concatenate(([0], np.cumsum(np.count_nonzero(X, axis=1))))
+        return cls(indptr, columns, X[rows, columns], X.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(
+        self,
+        rows: slice,
+    ) -> "CSRMatrix":
+        """Contiguous range of rows, sharing the arrays of this matrix."""
+        if not isinstance(rows, slice) or rows.step not in (None, 1):
+            raise TypeError("A CSRMatrix only supports contiguous row slices.")
+
+        start, stop, _ = rows.indices(len(self))
+        stop = max(start, stop)
+
+        matrix = CSRMatrix.__new__(CSRMatrix)
+        matrix.indptr = self.indptr[start : stop + 1]
+        matrix.indices = self.indices
+        matrix.data = self.data
+        matrix.shape = (stop - start, self.shape[1])
+        matrix._base = self._base
+        matrix._row_start = self._row_start + start
+        matrix._columns = None
+        return matrix
+
+    def _nonzeros(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Row, column and value of the nonzeros of these rows."""
+        positions = slice(self.indptr[0], self.indptr[-1])
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return rows, self.indices[positions], self.data[positions]
+
+    def squared_norms(self) -> np.ndarray:
+        """Squared euclidean norm of every row."""
+        rows, _, values = self._nonzeros()
+        return np.bincount(rows, weights=values**2, minlength=len(self))
+
+    def columns(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Column-major copy of the nonzeros of the original matrix: column
+        offsets of shape (d + 1,), and the row and value of every nonzero,
+        sorted on column and then on row. Built on first use.
+        """
+        base = self._base
+        if base._columns is None:
+            rows, columns, values = base._nonzeros()
+            # A stable sort keeps the rows within every column in order.
+            order = np.argsort(columns, kind="stable")
+            column_indptr = np.concatenate(
+                ([0], np.cumsum(np.bincount(columns, minlength=base.shape[1])))
+            )
+            base._columns = (column_indptr, rows[order], values[order])
+        return base._columns
+
+    def dot_transposed(
+        self,
+        other: "CSRMatrix",
+    ) -> np.ndarray:
+        """
+        Dense matrix of dot products between the rows of this matrix and the
+        rows of `other`, of shape (len(self), len(other)).
+        """
+        # Imported here, so that importing this module does not import numba.
+        from numba_kernels import sparse_products
+
+        if self.shape[1] != other.shape[1]:
+            raise ValueError(
+                f"Got {self.shape[1]} columns, but the other matrix has "
+                f"{other.shape[1]}."
+            )
+
+        return sparse_products(
+            self.indptr,
+            self.indices,
+            self.data,
+            *other.columns(),
+            other._row_start,
+            other._row_start + len(other),
+        )
+
+    def copy(self) -> "CSRMatrix":
+        """Copy of these rows that does not share arrays with this matrix."""
+        _, columns, values = self._nonzeros()
+        return CSRMatrix(
+            self.indptr - self.indptr[0],
+            columns.copy(),
+            values.copy(),
+            self.shape,
+        )
+
+    def equals(
+        self,
+        other: "CSRMatrix",
+    ) -> bool:
+        """Whether both matrices have the same nonzeros in the same order."""
+        if self.shape != other.shape or not np.array_equal(
+            np.diff(self.indptr), np.diff(other.indptr)
+        ):
+            return False
+
+        _, columns, values = self._nonzeros()
+        _, other_columns, other_values = other._nonzeros()
+        return np.array_equal(columns, other_columns) and np.array_equal(
+            values, other_values
+        )
+
+
+def is_sparse(X: object) -> bool:
+    """Whether X looks like a sparse matrix with CSR attributes."""
+    return all(
+        hasattr(X, attribute) for attribute in ["indptr", "indices", "data"]
+    )
+
+
+def as_csr(X: object) -> CSRMatrix:
+    """
+    Wrap a sparse matrix, such as a scipy.sparse csr_matrix, as a CSRMatrix
+    without copying its arrays.
+    """
+    if isinstance(X, CSRMatrix):
+        return X
+
+    # A CSC matrix has the same attributes, with the roles of rows and columns
+    # swapped.
+    matrix_format = getattr(X, "format", "csr")
+    if matrix_format != "csr":
+        raise ValueError(
+            f"Expected a sparse matrix in 'csr' format, but got "
+            f"'{matrix_format}'."
+        )
+
+    return CSRMatrix(X.indptr, X.indices, X.data, X.shape)
+
+
+def sparse_distances(
+    X1: CSRMatrix,
+    X2: CSRMatrix,
+    distance_metric: str,
+    X2_squared_norms: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Distances between sparse rows, computed from their dot products and
+    squared norms without densifying either matrix.
+
+    Args:
+        X1 (CSRMatrix): Matrix of shape (n1, d).
+        X2 (CSRMatrix): Matrix of shape (n2, d).
+        distance_metric (str): One of SPARSE_METRICS.
+        X2_squared_norms (np.ndarray, optional): Precomputed squared norms of
+            the rows of X2.
+
+    Returns:
+        np.ndarray: Dense distance matrix of shape (n1, n2).
+    """
+    if distance_metric not in SPARSE_METRICS:
+        raise ValueError(
+            f"Sparse inputs only support the metrics {SPARSE_METRICS}, but "
+            f"got '{distance_metric}'."
+        )
+
+    if X2_squared_norms is None:
+        X2_squared_norms = X2.squared_norms()
+
+    from_products = {
+        "euclidean": euclidean_from_products,
+        "cosine": cosine_from_products,
+    }[distance_metric]
+    return from_products(
+        X1.dot_transposed(X2), X1.squared_norms(), X2_squared_norms
+    )
@@ -0,0 +1,141 @@
+"""
+Training points that do not fit in memory, read chunk by chunk.
+
+A training source only has to produce its points in order, in chunks. The
+KNNClassifier scans every chunk against the whole batch of queries and keeps a
+running top-k per query, so each prediction reads the source exactly once,
+sequentially. The next chunks are read in a background thread while the
+current one is compared with the queries.
+"""
+
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from typing import Callable
+
+import numpy as np
+
+# Number of chunks that are read ahead of the one that is being compared.
+PREFETCH_DEPTH = 2
+
+
+class ArraySource:
+    """
+    Training points in an array that is read in chunks, typically a np.memmap
+    of a file that is larger than memory. Only the chunks that are being
+    compared, or have been read ahead, are in memory.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+    ) -> None:
+        """
+        Wrap an array.
+
+        Args:
+            X (np.ndarray): Points of shape (n, d), of any numeric dtype. It is
+                never converted as a whole, only chunk by chunk.
+        """
+        if X.ndim != 2:
+            raise ValueError("Expected an array of shape (n, d).")
+
+        self.X = X
+
+    def __len__(self) -> int:
+        return len(self.X)
+
+    @property
+    def n_dimensions(self) -> int:
+        return self.X.shape[1]
+
+    def chunks(
+        self,
+        chunk_size: int,
+    ) -> Iterator[np.ndarray]:
+        """Yield consecutive float64 chunks of at most chunk_size points."""
+        for start in range(0, len(self.X), chunk_size):
+            # The copy reads the pages of a memory-mapped file, so the I/O
+            # happens wherever the iterator is advanced.
+            yield np.array(self.X[start : start + chunk_size], dtype=float)
+
+
+class ChunkSource:
+    """
+    Training points that are produced chunk by chunk, for example by reading
+    a directory of files. The chunk sizes are determined by the source.
+    """
+
+    def __init__(
+        self,
+        make_chunks: Callable[[], Iterable[np.ndarray]],
+    ) -> None:
+        """
+        Wrap a function that produces the chunks.
+
+        Args:
+            make_chunks (Callable): Returns a new iterable over arrays of shape
+                (n_chunk, d) each time it is called, since every prediction
+                reads all training points again. The points must come in the
+                same order as the labels passed to `fit`.
+        """
+        self.make_chunks = make_chunks
+
+    def chunks(
+        self,
+        chunk_size: int,
+    ) -> Iterator[np.ndarray]:
+        """Yield the chunks of the source as float64, chunk_size is unused."""
+        for chunk in self.make_chunks():
+            yield np.asarray(chunk, dtype=float)
+
+
+def prefetch(
+    iterable: Iterable,
+    depth: int = PREFETCH_DEPTH,
+) -> Iterator:
+    """
+    Advance an iterable in a background thread, at most `depth` items ahead of
+    the consumer, so that reading the next chunk overlaps with computing on
+    the current one.
+
+    Exceptions of the iterable are raised in the consumer. When the consumer
+    stops early, the background thread stops as well.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item: object) -> bool:
+        """Put an item on the queue, unless the consumer has stopped."""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as error:
+            put((None, error))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
@@ -1,189 +1,202 @@
-""" """
+"""Heightmap generation with the diamond-square algorithm."""
 
-import random as rd
 import math
+from typing import Optional
+
+import numpy as np
+
 from constants import Size
 
 
 class DiamondSquare:
-    """ """
+    """
+    Diamond-square algorithm on a square grid of 2^n + 1 cells per side.
+
+    The heightmap is a float32 NumPy array. Every level halves the step size
+    and runs a diamond pass followed by a square pass. A pass sets all of its
+    midpoints at once with strided slices and one batched random draw, so no
+    Python code runs per cell and a grid of N cells is generated in O(N).
+    """
 
     def __init__(
         self,
         grid_dimensions: Size,
         h: float,
+        seed: Optional[int] = None,
     ) -> None:
+        """
+        Initialising the DiamondSquare class.
+
+        Args:
+            grid_dimensions (Size): Width and height of the grid, both equal to
+                2^n + 1 for some n >= 1.
+            h (float): Scaling constant between 0.0 and 1.0, the random
+                displacement of level i is scaled by 2^(-i * h).
+            seed (int, optional): Seed of the random generator.
+        """
+        width, height = grid_dimensions
+        if width != height or width < 3 or (width - 1) & (width - 2):
+            raise ValueError(
+                "Expected a square grid of 2^n + 1 cells per side, but got "
+                f"{width} x {height}."
+            )
+        if not (0.0 <= h <= 1.0):
+            raise ValueError("Parameter 'h' must be between 0.0 and 1.0.")
+
         self.grid_dimensions = grid_dimensions
         self.h = h
-        self.corner_names = ["top_left", "top_right", "bottom_left", "bottom_right"]
-        self.diamond_directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-        self.square_directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        self.grid = [
-            [None for _ in range(grid_dimensions.width)] for _ in range(grid_dimensions.height)
+        self.rng = np.random.default_rng(seed)
+        self.corner_names = [
+            "top_left",
+            "top_right",
+            "bottom_left",
+            "bottom_right",
         ]
+        self.grid = np.zeros((height, width), dtype=np.float32)
 
-        self.corner_values = self.determine_corner_values(mode="one_value", value=10)
+        self.corner_values = self.determine_corner_values(
+            mode="one_value", value=10
+        )
 
-    def determine_corner_values(self, mode: str, value: int) -> dict[str, float]:
-        """ """
-        if mode == "one_value":
-            if not isinstance(value, (int, float)):
-                raise TypeError(
-                    f"Expected 'value' to be of type int or float when mode is 'one_value', but got {type(value).__name__}."
-                )
-            return {key: value for key in self.corner_names}
+    def determine_corner_values(
+        self, mode: str, value: float
+    ) -> dict[str, float]:
+        """
+        Values of the four corners of the grid.
+
+        Args:
+            mode (str): "one_value" gives every corner the same value.
+            value (float): Value of the corners.
+
+        Returns:
+            dict[str, float]: Value per corner name.
+        """
+        if mode != "one_value":
+            raise ValueError(
+                f"Unknown mode '{mode}'. Options are ['one_value']."
+            )
+        if not isinstance(value, (int, float)):
+            raise TypeError(
+                "Expected 'value' to be of type int or float when mode is "
+                f"'one_value', but got {type(value).__name__}."
+            )
+        return {key: value for key in self.corner_names}
 
     def initialise_corners(
         self,
     ) -> None:
-        """ """
+        """Set the corners of the grid to the corner values."""
         if not self.corner_values:
-            raise ValueError("Corners can not be initialised. Corners values have not been set yet")
-
-        self.grid[0][0] = self.corner_values[self.corner_names[0]]
-        self.grid[0][-1] = self.corner_values[self.corner_names[1]]
-        self.grid[-1][0] = self.corner_values[self.corner_names[2]]
-        self.grid[-1][-1] = self.corner_values[self.corner_names[3]]
-
-    def exists_grid_element(
-        self,
-        x: int,
-        y: int,
-    ) -> bool:
-        """ """
-        exists = 0 <= y < self.grid_dimensions.height and 0 <= x < self.grid_dimensions.width
-        return exists
-
-    def are_grid_elements_not_none(self, list_of_tuples):
-        """ """
-        return all(self.grid[y][x] is not None for x, y in list_of_tuples)
-
-    def find_valid_directions(self, x: int, y: int, directions: list[tuple[int, int]]) -> bool:
-        """ """
-        valid_directions = []
-
-        for dx, dy in self.diamond_directions:
-            if self.exists_grid_element(x=x + dx, y=y + dy):
-                valid_directions.append((dx, dy))
+            raise ValueError(
+                "Corners can not be initialised. Corners values have not been "
+                "set yet."
+            )
 
-        return valid_directions
+        self.grid[0, 0] = self.corner_values[self.corner_names[0]]
+        self.grid[0, -1] = self.corner_values[self.corner_names[1]]
+        self.grid[-1, 0] = self.corner_values[self.corner_names[2]]
+        self.grid[-1, -1] = self.corner_values[self.corner_names[3]]
 
-    def determine_if_midpoint(
-        self,
-        x: int,
-        y: int,
-        directions,
-    ) -> bool:
-        """ """
-        valid_directions = self.find_valid_directions(x, y, directions)
-
-        neighbor_coordinates = [
-            (x + x_direction, y + y_direction) for (x_direction, y_direction) in valid_directions
-        ]
-
-        if self.are_grid_elements_not_none(neighbor_coordinates):
-            return neighbor_coordinates
-
-        while not self.are_grid_elements_not_none(neighbor_coordinates):
-            neighbor_coordinates = [
-                (
-                    neighbor_coordinates[index][0] + x_direction,
-                    neighbor_coordinates[index][1] + y_direction,
-                )
-                for index, (x_direction, y_direction) in enumerate(valid_directions)
-            ]
-            for y, x in neighbor_coordinates:
-                if self.exists_grid_element(x, y):
-                    return False
-
-            if self.are_grid_elements_not_none(neighbor_coordinates):
-                return neighbor_coordinates
-
-        # neighbor_found = False
-
-        # for x_direction, y_direction in directions:
-        #     x_new, y_new = x + x_direction, y + y_direction
-        #     if not self.exists_grid_element(x_new, y_new):
-        #         continue
-
-        #     neighbor_found = False
-        #     while self.exists_grid_element(x_new, y_new):
-        #         if self.grid[y_new][x_new]:
-        #             neighbor_found = True
-
-        #         x_new, y_new = x_new + x_direction, y_new + y_direction
-
-        #     if not neighbor_found:
-        #         break
-
-        # return neighbor_found
-        return False
-
-    def obtain_coordinate_pairs(
-        self,
-        step_name: str,
-    ) -> set[tuple[int, int]]:
-        """ """
-        if step_name not in ["diamond", "square"]:
-            raise ValueError(f"Invalid step_name '{step_name}'. Expected 'diamond' or 'square'.")
-
-        coordinates = set()
-        directions = self.diamond_directions if step_name == "diamond" else self.square_directions
-
-        for y in range(self.grid_dimensions.height):
-            for x in range(self.grid_dimensions.width):
-                if self.grid[y][x] is not None:
-                    continue
-
-                if self.determine_if_midpoint(x, y, directions):
-                    coordinates.add((x, y))
-
-        return coordinates
-
-    def set_values(self, midpoint_coordinates_and_values: dict[tuple, float]) -> None:
-        for midpoint_coordinates, midpoint_value in midpoint_coordinates_and_values.items():
-            x, y = midpoint_coordinates[0], midpoint_coordinates[1]
-            self.grid[x][y] = midpoint_value + self.obtain_random_value()
-
-    def obtain_random_value(
+    def obtain_random_values(
         self,
+        size: int,
         iteration: int = 1,
-    ) -> float:
+    ) -> np.ndarray:
         """
-        Generate a random value adjusted by a scale constant that decreases with each iteration.
+        Generate random values adjusted by a scale constant that decreases
+        with each iteration.
 
         Args:
+            size (int): Number of values.
             iteration (int): The current iteration number.
 
         Returns:
-            float: A random value scaled by the factor 2^(-iteration * h).
+            np.ndarray: Uniform values in [-1, 1) of dtype float32, scaled by
+                the factor 2^(-iteration * h).
         """
-        if not (0.0 <= self.h <= 1.0):
-            raise ValueError("Parameter 'h' must be between 0.0 and 1.0.")
-
-        random_value = rd.uniform(-1, 1)
         scale_constant = math.pow(2, -iteration * self.h)
-        return random_value * scale_constant
+        random_values = self.rng.random(size, dtype=np.float32)
+        random_values *= 2 * scale_constant
+        random_values -= scale_constant
+        return random_values
 
     def perform_diamond_step(
         self,
+        step: int,
+        iteration: int,
     ) -> None:
-        """ """
-        self.obtain_coordinate_pairs(step_name="diamond")
+        """
+        Set the centre of every square of side `step` to the mean of its four
+        corners plus a random displacement.
+        """
+        half = step // 2
+        centres = self.grid[half::step, half::step]
+
+        centres[:] = self.grid[:-1:step, :-1:step]
+        centres += self.grid[:-1:step, step::step]
+        centres += self.grid[step::step, :-1:step]
+        centres += self.grid[step::step, step::step]
+        centres *= 0.25
+        centres += self.obtain_random_values(centres.size, iteration).reshape(
+            centres.shape
+        )
+
+    def perform_square_step(
+        self,
+        step: int,
+        iteration: int,
+    ) -> None:
+        """
+        Set the midpoint of every edge of side `step` to the mean of its
+        neighbours at distance step / 2 plus a random displacement. Midpoints on
+        the border of the grid have three neighbours, the others four.
+        """
+        half = step // 2
+        centres = self.grid[half::step, half::step]
+        # Midpoints of the horizontal edges and of the vertical edges.
+        horizontal = self.grid[::step, half::step]
+        vertical = self.grid[half::step, ::step]
+
+        horizontal[:] = self.grid[::step, :-1:step]
+        horizontal += self.grid[::step, step::step]
+        horizontal[:-1] += centres
+        horizontal[1:] += centres
+        horizontal[1:-1] *= 1 / 4
+        horizontal[[0, -1]] *= 1 / 3
+
+        vertical[:] = self.grid[:-1:step, ::step]
+        vertical += self.grid[step::step, ::step]
+        vertical[:, :-1] += centres
+        vertical[:, 1:] += centres
+        vertical[:, 1:-1] *= 1 / 4
+        vertical[:, [0, -1]] *= 1 / 3
+
+        random_values = self.obtain_random_values(
+            horizontal.size + vertical.size, iteration
+        )
+        horizontal += random_values[: horizontal.size].reshape(horizontal.shape)
+        vertical += random_values[horizontal.size :].reshape(vertical.shape)
 
     def execute(
         self,
-    ):
-        """ """
-        self.initialise_corners()
+    ) -> np.ndarray:
+        """
+        Generate the heightmap, level by level from a step of the whole grid
+        down to a step of two cells.
 
-        for row in self.grid:
-            print(row)
+        Returns:
+            np.ndarray: The heightmap of shape (height, width), dtype float32.
+        """
+        self.grid[:] = 0
+        self.initialise_corners()
 
-        self.perform_diamond_step()
-        # print()
+        step = self.grid_dimensions.width - 1
+        iteration = 1
 
-        # for row in self.grid:
-        #     print(row)
+        while step > 1:
+            self.perform_diamond_step(step, iteration)
+            self.perform_square_step(step, iteration)
+            step //= 2
+            iteration += 1
 
-        # self.perform_square_step()
+        return self.grid
@@ -1,12 +1,14 @@
 """ """
 
+import time
+
 from diamond_square import DiamondSquare
 from constants import Size, h
 
 
 def main():
     n = 2
-    grid_dim = 2 * n + 1
+    grid_dim = 2**n + 1
     grid_dimensions = Size(grid_dim, grid_dim)
 
     diamond_square = DiamondSquare(
@@ -14,7 +16,10 @@ def main():
         h=h,
     )
 
+    start = time.perf_counter()
     diamond_square.execute()
+    seconds = time.perf_counter() - start
+    print(f"Generated a {grid_dim} x {grid_dim} heightmap in {seconds:.3f}s.")
 
 
 if __name__ == "__main__":